@@ -0,0 +1,369 @@
+# run.py  – upload → parse → reconcile benchmark harness
+#
+# Run from backend/:
+#   python -m benchmarks.run --docs 20 --llm-latency-ms 300 --concurrency 4
+#   python -m benchmarks.run --save-baseline            # store benchmarks/baseline.json
+#   python -m benchmarks.run --stages parse,api         # subset; exits 1 on regressions
+#   python -m benchmarks.run --stages startup           # import / lifespan / prewarm time
+#
+# Every stage runs in its own spawned process against a fresh SQLite file and
+# the shared stub LLM, so the peak RSS reported for a stage is that stage's own.
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.stub_llm import StubLLMServer  # noqa: E402
+from benchmarks import synthetic_docs  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "baseline.json")
+ALL_STAGES = ("ocr_text", "ocr_scanned", "parse", "detect", "api", "startup")
+
+
+# ---------- statistics ----------
+def percentile(values: list, p: float) -> float:
+    """Linear-interpolated percentile, p in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(latencies: list, wall_seconds: float) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "throughput_per_s": round(len(latencies) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+    }
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed(fn, items, concurrency: int = 1):
+    """Run fn over items; returns (latencies in seconds, wall seconds)."""
+    def _one(item):
+        start = time.perf_counter()
+        fn(item)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(_one, items))
+    else:
+        latencies = [_one(item) for item in items]
+    return latencies, time.perf_counter() - start
+
+
+# ---------- stages (each runs inside a fresh child process) ----------
+def _stage_ocr_text(cfg: dict) -> dict:
+    from extraction import TEXT_BACKENDS, extract_file
+    paths = [p for pair in cfg["text_corpus"] for p in pair[:2]]
+    metrics = {"ocr_text_pdf": _timed(extract_file, paths)}
+    for backend in TEXT_BACKENDS:
+        metrics[f"ocr_text_pdf_{backend}"] = _timed(lambda p: extract_file(p, backend=backend), paths)
+    return metrics
+
+
+def _stage_ocr_scanned(cfg: dict) -> dict:
+    import pytesseract
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception:
+        print("[BENCH] Tesseract not installed, skipping scanned OCR stage.")
+        return {}
+    from extraction import extract_file
+    paths = [p for pair in cfg["scanned_corpus"] for p in pair[:2]]
+    return {"ocr_scanned_pdf": _timed(extract_file, paths, cfg["concurrency"])}
+
+
+def _stage_parse(cfg: dict) -> dict:
+    from db import init_db
+    import models  # noqa: F401  (registers the tables, including parse_cache)
+    import field_extractor
+    import parse_cache
+    import parser_local
+    init_db()
+    paths = [p for pair in cfg["text_corpus"] for p in pair[:2]]
+    # Cold parses go to the (stub) LLM; the rule-based fast path is measured separately below
+    field_extractor.RULES_ENABLED = False
+    results = {"parse_cold": _timed(parser_local.parse_with_shivaay_ai, paths, cfg["concurrency"])}
+    # Second pass over identical bytes is served by the parse cache
+    results["parse_cache_hit"] = _timed(parser_local.parse_with_shivaay_ai, paths, cfg["concurrency"])
+    field_extractor.RULES_ENABLED = True
+    parse_cache.CACHE_ENABLED = False
+    results["parse_rules"] = _timed(parser_local.parse_with_shivaay_ai, paths, cfg["concurrency"])
+    return results
+
+
+def _stage_detect(cfg: dict) -> dict:
+    from discrepancy_engine import (
+        detect_discrepancies, detect_discrepancies_batch, records_to_columns, INVOICE_COLUMNS, PO_COLUMNS
+    )
+    pairs = synthetic_docs.make_pairs(cfg["detect_pairs"], seed=cfg["seed"])
+    results = {"detect_discrepancies": _timed(lambda pair: detect_discrepancies(*pair), pairs)}
+
+    invoices = records_to_columns([p[0] for p in pairs], INVOICE_COLUMNS)
+    pos = records_to_columns([p[1] for p in pairs], PO_COLUMNS)
+    results["detect_discrepancies_batch"] = _timed(
+        lambda _: detect_discrepancies_batch(invoices, pos), range(cfg["repeat"])
+    )
+    return results
+
+
+def _stage_api(cfg: dict) -> dict:
+    # main mounts ./static and writes ./uploads relative to the working directory
+    os.symlink(os.path.join(BACKEND_DIR, "static"), os.path.join(cfg["workdir"], "static"))
+    os.chdir(cfg["workdir"])
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:  # runs the lifespan (database init, prewarm)
+
+        def _wait(job_id: str) -> dict:
+            while True:
+                job = client.get(f"/jobs/{job_id}").json()
+                if job["status"] in ("done", "failed"):
+                    return job
+                time.sleep(0.005)
+
+        def _upload(item):
+            endpoint, path = item
+            with open(path, "rb") as f:
+                resp = client.post(endpoint, files={"file": (os.path.basename(path), f, "application/pdf")})
+            _wait(resp.json()["job_id"])
+
+        uploads = []
+        for invoice_path, po_path, _, _ in cfg["text_corpus"]:
+            uploads += [("/upload-invoice", invoice_path), ("/upload-po", po_path)]
+
+        results = {"api_upload_to_parsed": _timed(_upload, uploads, cfg["concurrency"])}
+        results["api_detect_discrepancy"] = _timed(lambda _: client.get("/detect-discrepancy"), range(cfg["repeat"]))
+        results["api_reconcile_batch"] = _timed(
+            lambda _: client.post("/reconcile-batch", params={"include_matched": True}), range(cfg["repeat"])
+        )
+    return results
+
+
+# Runs in a fresh interpreter per sample, so nothing is already imported
+_STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+import components
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.get("/health")
+    for name in components.PREWARM:
+        components.get(name)
+    warmed = time.perf_counter()
+print(json.dumps({"import": imported - started, "ready": ready - started, "prewarmed": warmed - started}))
+"""
+
+
+def _stage_startup(cfg: dict) -> dict:
+    import subprocess
+    os.symlink(os.path.join(BACKEND_DIR, "static"), os.path.join(cfg["workdir"], "static"))
+    samples = {"startup_import_main": [], "startup_ready": [], "startup_prewarmed": []}
+    started = time.perf_counter()
+    for _ in range(cfg["startup_runs"]):
+        # The same database each run: the first run creates it, later ones measure a warm restart
+        out = subprocess.run(
+            [sys.executable, "-c", _STARTUP_PROBE, BACKEND_DIR],
+            cwd=cfg["workdir"], env=dict(os.environ), capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        timings = json.loads(out)
+        samples["startup_import_main"].append(timings["import"])
+        samples["startup_ready"].append(timings["ready"])
+        samples["startup_prewarmed"].append(timings["prewarmed"])
+    wall = time.perf_counter() - started
+    return {name: (values, wall) for name, values in samples.items()}
+
+
+STAGE_FUNCTIONS = {
+    "ocr_text": _stage_ocr_text,
+    "ocr_scanned": _stage_ocr_scanned,
+    "parse": _stage_parse,
+    "detect": _stage_detect,
+    "api": _stage_api,
+    "startup": _stage_startup,
+}
+
+
+def _stage_entry(stage: str, cfg: dict, queue) -> None:
+    os.environ["VERIFIN_DATABASE_URL"] = f"sqlite:///{os.path.join(cfg['workdir'], 'verifin.db')}"
+    try:
+        raw = STAGE_FUNCTIONS[stage](cfg)
+        metrics = {name: summarize(lat, wall) for name, (lat, wall) in raw.items()}
+        queue.put({"stage": stage, "metrics": metrics, "peak_rss_mb": _peak_rss_mb()})
+    except Exception as e:
+        queue.put({"stage": stage, "error": f"{type(e).__name__}: {e}"})
+
+
+def run_stage(stage: str, cfg: dict) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_stage_entry, args=(stage, cfg, queue), name=f"bench-{stage}")
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+# ---------- baseline comparison ----------
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Metrics whose p95 grew, or whose throughput dropped, by more than threshold."""
+    regressions = []
+    for metric, current in results["metrics"].items():
+        base = baseline.get("metrics", {}).get(metric)
+        if not base:
+            continue
+        if base["p95_ms"] > 0 and current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{metric}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+        if base["throughput_per_s"] > 0 and current["throughput_per_s"] < base["throughput_per_s"] * (1 - threshold):
+            regressions.append(
+                f"{metric}: throughput {base['throughput_per_s']}/s -> {current['throughput_per_s']}/s"
+            )
+    return regressions
+
+
+def print_report(results: dict, baseline: dict = None) -> None:
+    header = f"{'metric':<28}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/s':>10}{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for metric, m in results["metrics"].items():
+        line = (
+            f"{metric:<28}{m['count']:>6}{m['p50_ms']:>11.2f}{m['p95_ms']:>11.2f}"
+            f"{m['p99_ms']:>11.2f}{m['throughput_per_s']:>10.2f}{m['peak_rss_mb']:>9.1f}"
+        )
+        base = (baseline or {}).get("metrics", {}).get(metric)
+        if base and base["p95_ms"]:
+            line += f"   p95 {100 * (m['p95_ms'] / base['p95_ms'] - 1):+.1f}% vs baseline"
+        print(line)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the upload → parse → reconcile path")
+    parser.add_argument("--stages", default=",".join(ALL_STAGES), help=f"comma-separated subset of {ALL_STAGES}")
+    parser.add_argument("--docs", type=int, default=10, help="invoice/PO pairs per corpus")
+    parser.add_argument("--pages", type=int, default=1, help="pages per synthetic document")
+    parser.add_argument("--detect-pairs", type=int, default=20000, help="pairs for the discrepancy stage")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions for batch/endpoint metrics")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters for the startup stage")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression ratio (0.10 = 10%%)")
+    parser.add_argument("--output", help="also write the results JSON here")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(ALL_STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)}")
+
+    root = tempfile.mkdtemp(prefix="verifin-bench-")
+    stub = StubLLMServer(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms).start()
+    # Child processes inherit these before importing any backend module
+    os.environ.update({
+        "SHIVAAY_BASE_URL": stub.base_url,
+        "SHIVAAY_API_KEY": "bench",
+        "SHIVAAY_MODEL": "stub",
+    })
+
+    try:
+        print(f"[BENCH] Generating {args.docs} synthetic pairs ({args.pages} page(s) each) in {root}")
+        cfg = {
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "detect_pairs": args.detect_pairs,
+            "repeat": args.repeat,
+            "startup_runs": args.startup_runs,
+            "text_corpus": synthetic_docs.generate_corpus(
+                os.path.join(root, "docs"), args.docs, args.pages, scanned=False, seed=args.seed),
+            "scanned_corpus": synthetic_docs.generate_corpus(
+                os.path.join(root, "docs"), args.docs, args.pages, scanned=True, seed=args.seed)
+            if "ocr_scanned" in stages else [],
+        }
+
+        results = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "output", "save_baseline")},
+            "host": {"python": platform.python_version(), "platform": platform.platform(),
+                     "cpus": os.cpu_count()},
+            "metrics": {},
+            "errors": {},
+        }
+        for stage in stages:
+            workdir = os.path.join(root, stage)
+            os.makedirs(workdir, exist_ok=True)
+            print(f"[BENCH] Stage {stage} ...")
+            outcome = run_stage(stage, dict(cfg, workdir=workdir))
+            if "error" in outcome:
+                print(f"[BENCH] Stage {stage} failed: {outcome['error']}")
+                results["errors"][stage] = outcome["error"]
+                continue
+            for metric, m in outcome["metrics"].items():
+                results["metrics"][metric] = dict(m, stage=stage, peak_rss_mb=outcome["peak_rss_mb"])
+        results["stub_llm_requests"] = stub.requests
+    finally:
+        stub.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print()
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[BENCH] Baseline saved to {args.baseline}")
+        return 0
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n[BENCH] {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for r in regressions:
+                print(f"  - {r}")
+            return 1
+        print(f"\n[BENCH] No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
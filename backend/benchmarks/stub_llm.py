@@ -0,0 +1,154 @@
+# stub_llm.py  – local OpenAI-compatible chat completions server for benchmarks
+#
+# Parser prompts get JSON built from the "Label: value" lines of the document
+# text, SQL prompts get a fixed SELECT, anything else gets a short summary.
+# Start standalone with:  python -m benchmarks.stub_llm --port 8765 --latency-ms 300
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD_PATTERNS = {
+    "invoice_number": r"Invoice Number:\s*(.+)",
+    "vendor": r"Vendor:\s*(.+)",
+    "purchase_order_reference": r"PO Reference:\s*(.+)",
+    "purchase_order_id": r"Purchase Order ID:\s*(.+)",
+    "total_amount": r"Total Amount:\s*([\d.,]+)",
+    "total_value": r"Total Value:\s*([\d.,]+)",
+    "invoice_date": r"Invoice Date:\s*(\S+)",
+    "order_date": r"Order Date:\s*(\S+)",
+}
+
+STUB_SQL = (
+    "SELECT i.id, p.id, i.total_amount, p.total_value FROM invoice_data i "
+    "JOIN po_data p ON i.purchase_order_reference = p.purchase_order_id "
+    "WHERE i.total_amount > p.total_value"
+)
+
+
+def _fake_parse(prompt: str) -> str:
+    document = prompt.split("Document text:", 1)[-1]
+    fields = {}
+    for key, pattern in FIELD_PATTERNS.items():
+        m = re.search(pattern, document)
+        value = m.group(1).strip() if m else None
+        if value and key.startswith("total"):
+            value = float(value.replace(",", ""))
+        fields[key] = value
+    return json.dumps(fields)
+
+
+def _reply_for(messages: list) -> str:
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "Document text:" in prompt:
+        return _fake_parse(prompt)
+    if "SQL" in prompt:
+        return STUB_SQL
+    return "Stub summary: the invoice and purchase order differ in the listed fields."
+
+
+class StubLLMServer:
+    """Threaded HTTP server; latency per request is normal(latency, jitter), clipped at 0."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+
+                delay = max(0.0, random.gauss(stub.latency_ms, stub.jitter_ms)) / 1000
+                time.sleep(delay)
+
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                if stub.error_rate and random.random() < stub.error_rate:
+                    self._send(429, {"error": {"message": "stub rate limit"}})
+                    return
+
+                messages = request.get("messages", [])
+                content = _reply_for(messages)
+                prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+                self._send(200, {
+                    "id": f"stub-{stub.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": prompt_tokens + len(content) // 4,
+                    },
+                })
+
+        return Handler
+
+    def start(self) -> "StubLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server = StubLLMServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate).start()
+    print(f"[STUB LLM] Serving on {server.base_url} (latency {args.latency_ms}±{args.jitter_ms} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# synthetic_docs.py  – deterministic synthetic invoices / POs for benchmarks
+import os
+import random
+from datetime import date, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+VENDORS = [
+    "Acme Corporation", "Globex Ltd", "Initech Supplies", "Umbrella Traders",
+    "Stark Industrial", "Wayne Components", "Hooli Hardware", "Soylent Foods",
+]
+LINES_PER_PAGE = 48
+
+
+def make_pairs(count: int, mismatch_rate: float = 0.3, seed: int = 42) -> list:
+    """
+    Field dicts for `count` invoice/PO pairs, shaped like parse_with_shivaay_ai
+    output. About mismatch_rate of the pairs differ in total, vendor or date.
+    """
+    rng = random.Random(seed)
+    pairs = []
+    for n in range(count):
+        vendor = rng.choice(VENDORS)
+        po_id = f"PO-{100000 + n}"
+        total = round(rng.uniform(100, 50000), 2)
+        order_date = date(2024, 1, 1) + timedelta(days=rng.randint(0, 365))
+        invoice = {
+            "invoice_number": f"INV-{500000 + n}",
+            "vendor": vendor,
+            "purchase_order_reference": po_id,
+            "total_amount": total,
+            "invoice_date": order_date.isoformat(),
+        }
+        po = {
+            "purchase_order_id": po_id,
+            "vendor": vendor,
+            "total_value": total,
+            "order_date": order_date.isoformat(),
+        }
+        if rng.random() < mismatch_rate:
+            kind = rng.choice(("total", "vendor", "date"))
+            if kind == "total":
+                invoice["total_amount"] = round(total * rng.uniform(1.01, 1.2), 2)
+            elif kind == "vendor":
+                invoice["vendor"] = rng.choice([v for v in VENDORS if v != vendor])
+            else:
+                invoice["invoice_date"] = (order_date + timedelta(days=rng.randint(6, 40))).isoformat()
+        pairs.append((invoice, po))
+    return pairs
+
+
+def _filler(rng: random.Random, count: int) -> list:
+    return [
+        f"{i + 1:>3}. Item SKU-{rng.randint(1000, 9999)}  qty {rng.randint(1, 50):>3}  "
+        f"unit {rng.uniform(1, 500):>8.2f}"
+        for i in range(count)
+    ]
+
+
+def invoice_lines(fields: dict, pages: int = 1, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    header = [
+        "INVOICE",
+        f"Invoice Number: {fields['invoice_number']}",
+        f"Vendor: {fields['vendor']}",
+        f"PO Reference: {fields['purchase_order_reference']}",
+        f"Invoice Date: {fields['invoice_date']}",
+        "",
+    ]
+    body = _filler(rng, max(1, pages * LINES_PER_PAGE - len(header) - 2))
+    return header + body + ["", f"Total Amount: {fields['total_amount']:.2f}"]
+
+
+def po_lines(fields: dict, pages: int = 1, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    header = [
+        "PURCHASE ORDER",
+        f"Purchase Order ID: {fields['purchase_order_id']}",
+        f"Vendor: {fields['vendor']}",
+        f"Order Date: {fields['order_date']}",
+        "",
+    ]
+    body = _filler(rng, max(1, pages * LINES_PER_PAGE - len(header) - 2))
+    return header + body + ["", f"Total Value: {fields['total_value']:.2f}"]
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(path: str, lines: list) -> str:
+    """Minimal multi-page PDF with a real text layer (Helvetica, US Letter)."""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    objects = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog_id = add(b"")  # filled once the page tree id is known
+    pages_id = add(b"")
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for page_lines in pages:
+        ops = ["BT", "/F1 10 Tf", "14 TL", "50 760 Td"]
+        ops += [f"({_pdf_escape(line)}) Tj T*" for line in page_lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % pid for pid in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow without FreeType size support
+        return ImageFont.load_default()
+
+
+def render_page_images(lines: list, dpi: int = 200, seed: int = 0) -> list:
+    """Render lines as grayscale 'scans' (slight noise) at the given DPI."""
+    rng = random.Random(seed)
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    font = _font(int(dpi / 7))
+    line_height = int(dpi / 5)
+    images = []
+    for start in range(0, max(len(lines), 1), LINES_PER_PAGE):
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        y = int(dpi * 0.6)
+        for line in lines[start:start + LINES_PER_PAGE]:
+            draw.text((int(dpi * 0.6), y), line, fill=0, font=font)
+            y += line_height
+        for _ in range(width * height // 2000):
+            draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randint(150, 230))
+        images.append(image)
+    return images
+
+
+def write_scanned_pdf(path: str, lines: list, dpi: int = 200, seed: int = 0) -> str:
+    """Image-only PDF (no text layer), so extraction has to fall back to OCR."""
+    images = render_page_images(lines, dpi=dpi, seed=seed)
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    return path
+
+
+def generate_corpus(out_dir: str, count: int, pages: int = 1, scanned: bool = False,
+                    mismatch_rate: float = 0.3, seed: int = 42) -> list:
+    """
+    Write `count` invoice/PO pairs to out_dir and return
+    [(invoice_path, po_path, invoice_fields, po_fields), ...].
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    writer = write_scanned_pdf if scanned else write_text_pdf
+    kind = "scan" if scanned else "text"
+    corpus = []
+    for n, (invoice, po) in enumerate(make_pairs(count, mismatch_rate, seed)):
+        invoice_path = os.path.join(out_dir, f"invoice_{kind}_{n:05d}.pdf")
+        po_path = os.path.join(out_dir, f"po_{kind}_{n:05d}.pdf")
+        writer(invoice_path, invoice_lines(invoice, pages, seed=seed + n))
+        writer(po_path, po_lines(po, pages, seed=seed + n + 1))
+        corpus.append((invoice_path, po_path, invoice, po))
+    return corpus
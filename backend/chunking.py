@@ -0,0 +1,130 @@
+# chunking.py  – splitting long documents and choosing which parts to parse
+#
+# Long documents are split by page (extraction separates pages with
+# PAGE_BREAK), oversized pages by blank-line sections. Each chunk is scored
+# with field_extractor.field_cues(); the chunks that cover the target fields
+# best are selected within a character budget, and the per-chunk LLM results
+# are merged field by field, preferring the chunk with the strongest cue.
+import re
+from typing import List, NamedTuple
+
+from field_extractor import FIELD_KEYS, field_cues
+
+# Separator extraction puts between pages (form feed on its own line).
+PAGE_BREAK = "\n\f\n"
+
+TARGET_FIELDS = ("number", "vendor", "total", "date")
+# parsed_data key -> generic field, for merging
+_KEY_FIELDS = {key: field for kind in FIELD_KEYS.values() for field, key in kind.items()}
+_KEY_FIELDS["purchase_order_reference"] = "number"
+
+_SECTION_BREAK = re.compile(r"\n[ \t]*\n")
+
+
+class Chunk(NamedTuple):
+    index: int
+    page: int
+    text: str
+    cues: dict
+
+
+def _pack(parts: List[str], max_chars: int, sep: str) -> List[str]:
+    """Greedily join parts with sep into pieces of at most max_chars (long parts are cut)."""
+    pieces, current = [], ""
+    for part in parts:
+        while len(part) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(part[:max_chars])
+            part = part[max_chars:]
+        if current and len(current) + len(sep) + len(part) > max_chars:
+            pieces.append(current)
+            current = part
+        else:
+            current = current + sep + part if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_chunks(text: str, max_chars: int) -> List[Chunk]:
+    """One chunk per page, or per group of sections/lines when a page exceeds max_chars."""
+    chunks = []
+    for page_number, page in enumerate(text.split(PAGE_BREAK), start=1):
+        page = page.strip()
+        if not page:
+            continue
+        if len(page) <= max_chars:
+            pieces = [page]
+        else:
+            sections = []
+            for section in _SECTION_BREAK.split(page):
+                sections.extend(_pack(section.splitlines(), max_chars, "\n") if len(section) > max_chars else [section])
+            pieces = _pack(sections, max_chars, "\n\n")
+        for piece in pieces:
+            chunks.append(Chunk(len(chunks), page_number, piece, field_cues(piece)))
+    return chunks
+
+
+def _gain(chunk: Chunk, covered: dict, is_first: bool, is_last: bool) -> float:
+    gain = 0.0
+    for field in TARGET_FIELDS:
+        score = chunk.cues[field]
+        # Letterheads carry the vendor and document number; the last page carries the totals
+        if (is_first and field in ("vendor", "number")) or (is_last and field == "total"):
+            score += 0.5
+        gain += max(0.0, score - covered.get(field, 0))
+    return gain
+
+
+def select_chunks(chunks: List[Chunk], budget_chars: int, max_chunks: int) -> List[Chunk]:
+    """
+    Greedy cover of the target fields: repeatedly take the chunk that adds the
+    most cue strength for fields not yet covered by a labelled value, while it
+    fits the budget. Returned in document order.
+    """
+    if not chunks:
+        return []
+    covered, selected, used = {}, [], 0
+    remaining = list(chunks)
+    last_index = chunks[-1].index
+    while remaining and len(selected) < max_chunks:
+        best = max(
+            remaining,
+            key=lambda c: (_gain(c, covered, c.index == 0, c.index == last_index), -c.index),
+        )
+        if _gain(best, covered, best.index == 0, best.index == last_index) <= 0:
+            break
+        remaining.remove(best)
+        if selected and used + len(best.text) > budget_chars:
+            continue
+        selected.append(best)
+        used += len(best.text)
+        for field in TARGET_FIELDS:
+            covered[field] = max(covered.get(field, 0), best.cues[field])
+        if all(covered.get(field, 0) >= 2 for field in TARGET_FIELDS):
+            break
+    if not selected:
+        selected = [chunks[0]]
+    return sorted(selected, key=lambda c: c.index)
+
+
+def merge_results(results: List[tuple]) -> dict:
+    """
+    Merge per-chunk parses [(chunk, parsed dict)] into one dict: for each key
+    the non-null value from the chunk with the strongest cue for that field
+    wins; ties go to the earlier chunk, except totals, which go to the later one.
+    """
+    merged, strength = {}, {}
+    for order, (chunk, parsed) in enumerate(results):
+        for key, value in parsed.items():
+            if value in (None, "", [], {}):
+                merged.setdefault(key, value)
+                continue
+            field = _KEY_FIELDS.get(key)
+            cue = chunk.cues.get(field, 0) if field else 0
+            rank = (cue, order if field == "total" else -order)
+            if key not in strength or rank > strength[key]:
+                merged[key], strength[key] = value, rank
+    return merged
@@ -0,0 +1,126 @@
+# components.py  – lazily initialized application components
+#
+# Importing the app should be cheap: a freshly autoscaled worker has to accept
+# uploads as soon as possible. Heavy stacks (PDF/OCR libraries, the LLM client,
+# schema creation and startup backfills) are registered here and built on
+# first use. main's lifespan builds "database" before serving and warms the
+# components listed in VERIFIN_PREWARM in a background thread.
+import importlib
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+# The one place .env is read; modules that read settings at import time
+# import this module first.
+load_dotenv()
+
+# Warmed in the background after startup; "" disables prewarming.
+PREWARM = [name.strip() for name in os.getenv("VERIFIN_PREWARM", "extraction,llm").split(",") if name.strip()]
+
+
+class Component:
+    def __init__(self, name: str, factory: Callable, close: Optional[Callable] = None):
+        self.name = name
+        self.factory = factory
+        self.close = close
+        self.value = None
+        self.ready = False
+        self.seconds = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.ready:
+            return self.value
+        with self._lock:
+            if not self.ready:
+                started = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    raise
+                self.seconds = time.perf_counter() - started
+                self.ready, self.error = True, None
+                print(f"[STARTUP] {self.name} ready in {self.seconds * 1000:.0f} ms")
+        return self.value
+
+
+_registry = {}
+
+
+def register(name: str, factory: Callable, close: Optional[Callable] = None) -> None:
+    _registry[name] = Component(name, factory, close)
+
+
+def get(name: str):
+    """The component's value, building it on first use (thread-safe, once)."""
+    return _registry[name].get()
+
+
+def is_ready(name: str) -> bool:
+    return _registry[name].ready
+
+
+def status() -> dict:
+    return {
+        name: {
+            "ready": c.ready,
+            "init_ms": round(c.seconds * 1000, 1) if c.seconds is not None else None,
+            "error": c.error,
+        }
+        for name, c in _registry.items()
+    }
+
+
+def prewarm(names=None) -> threading.Thread:
+    """Build components in a background thread; failures only log (first use retries)."""
+    names = PREWARM if names is None else names
+
+    def _run():
+        for name in names:
+            try:
+                get(name)
+            except Exception as e:
+                print(f"[STARTUP] Prewarming {name} failed: {e}")
+
+    thread = threading.Thread(target=_run, name="verifin-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def shutdown() -> None:
+    for c in _registry.values():
+        if c.ready and c.close is not None:
+            try:
+                c.close(c.value)
+            except Exception as e:
+                print(f"[SHUTDOWN] Closing {c.name} failed: {e}")
+
+
+# ---------- Components ----------
+def _database():
+    from db import init_db
+    import models  # noqa: F401  (registers the tables)
+    from migrations import backfill_parsed_fields
+    import vendors
+    init_db()
+    backfill_parsed_fields()
+    vendors.load()
+    return True
+
+
+def _llm():
+    import llm_gateway
+    gateway = llm_gateway.get_gateway()
+    gateway.start()
+    return gateway
+
+
+register("database", _database)
+# pdfplumber, pypdfium2, PIL and pytesseract, via extraction/ocr
+register("extraction", lambda: importlib.import_module("extraction"))
+register("llm", _llm, close=lambda gateway: gateway.close())
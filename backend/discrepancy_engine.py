@@ -1,3 +1,132 @@
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y")
+DATE_WINDOW_DAYS = 5
+# Trigram (Jaccard) similarity at or above which two vendor names are the same vendor
+VENDOR_SIMILARITY = float(os.getenv("VERIFIN_VENDOR_SIMILARITY", "0.7"))
+# Each distinctive word must also have a counterpart at least this similar
+VENDOR_TOKEN_SIMILARITY = 0.5
+
+
+def parse_date_safe(d):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(d, fmt)
+        except Exception:
+            continue
+    return None
+
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_ref(value) -> str:
+    """Same comparison detect_discrepancies uses for references: trimmed, case-insensitive."""
+    return str(value).strip().lower() if value else ""
+
+
+def normalize_vendor(value) -> str:
+    """Lowercase and collapse punctuation/whitespace so 'ACME, Inc.' == 'acme inc'."""
+    return _NON_ALNUM.sub(" ", str(value).lower()).strip() if value else ""
+
+
+# ====== Vendor matching ======
+_LEGAL_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited", "llc", "llp",
+    "plc", "pvt", "private", "gmbh", "ag", "sa", "bv", "pty", "the",
+}
+# Words many unrelated vendors share; they never make two names the same vendor
+_GENERIC_WORDS = {
+    "and", "of", "industries", "industry", "industrial", "steel", "traders", "trading", "enterprises",
+    "enterprise", "solutions", "services", "service", "systems", "technologies", "technology", "tech",
+    "international", "global", "group", "holdings", "supplies", "supply", "logistics", "exports",
+    "imports", "manufacturing", "products", "agencies", "associates", "distributors", "works",
+}
+# Canonical form -> canonical vendor key, loaded from the vendor_aliases table by vendors.py
+VENDOR_ALIASES = {}
+
+
+@lru_cache(maxsize=65536)
+def _canonical(text: str) -> str:
+    words = normalize_vendor(text).split()
+    while len(words) > 1 and words[-1] in _LEGAL_SUFFIXES:
+        words.pop()
+    while len(words) > 1 and words[0] == "the":
+        words.pop(0)
+    return " ".join(words)
+
+
+def canonical_vendor(value) -> str:
+    """normalize_vendor() without legal-form suffixes: 'ACME Corp.' == 'Acme Corporation' == 'acme'."""
+    return _canonical(str(value)) if value else ""
+
+
+@lru_cache(maxsize=65536)
+def vendor_trigrams(name: str) -> frozenset:
+    """Trigrams of each word padded like pg_trgm ('  w', ' wo', 'wor', 'ord', 'rd ')."""
+    grams = set()
+    for word in name.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def trigram_similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def _distinctive_words(key: str) -> list:
+    words = key.split()
+    return [w for w in words if w not in _GENERIC_WORDS] or words
+
+
+def vendor_similarity(a: str, b: str) -> float:
+    """
+    Trigram similarity of two canonical vendor keys, or 0.0 unless every
+    distinctive (non-generic) word of the name with fewer of them has a close
+    counterpart in the other: 'alpha industries' vs 'beta industries' is 0.0.
+    """
+    grams_a, grams_b = vendor_trigrams(a), vendor_trigrams(b)
+    score = trigram_similarity(grams_a, grams_b)
+    if score < VENDOR_SIMILARITY:
+        return score
+    words_a, words_b = _distinctive_words(a), _distinctive_words(b)
+    if len(words_a) > len(words_b):
+        words_a, words_b = words_b, words_a
+    for word in words_a:
+        if word in words_b:
+            continue
+        word_grams = vendor_trigrams(word)
+        if not any(trigram_similarity(word_grams, vendor_trigrams(other)) >= VENDOR_TOKEN_SIMILARITY
+                   for other in words_b):
+            return 0.0
+    return score
+
+
+def vendor_key(value) -> str:
+    """Canonical form, mapped through the alias table to the vendor it was resolved to."""
+    key = canonical_vendor(value)
+    return VENDOR_ALIASES.get(key, key)
+
+
+def same_vendor(a, b) -> bool:
+    """True if two vendor names are equal after canonicalization/aliases or similar enough."""
+    if a == b:
+        return True
+    if not a or not b:
+        return False
+    ka, kb = vendor_key(a), vendor_key(b)
+    return ka == kb or vendor_similarity(ka, kb) >= VENDOR_SIMILARITY
+
+
 def detect_discrepancies(invoice_data: dict, po_data: dict) -> dict:
     """
     Compares parsed invoice and purchase order data dictionaries and
@@ -28,28 +157,17 @@ def detect_discrepancies(invoice_data: dict, po_data: dict) -> dict:
         }
 
     # Compare dates (allow small differences)
-    from datetime import datetime
-
     invoice_date = invoice_data.get("invoice_date")
     po_date = po_data.get("order_date")
 
-    def parse_date_safe(d):
-        try:
-            return datetime.strptime(d, "%Y-%m-%d")
-        except Exception:
-            try:
-                return datetime.strptime(d, "%d-%m-%Y")
-            except Exception:
-                return None
-
     d1, d2 = parse_date_safe(invoice_date), parse_date_safe(po_date)
     if d1 and d2:
         diff_days = abs((d1 - d2).days)
-        if diff_days > 5:  # allow 5-day difference window
+        if diff_days > DATE_WINDOW_DAYS:  # allow 5-day difference window
             mismatches["date"] = {"invoice": invoice_date, "po": po_date}
 
-    # Match vendors
-    if invoice_data.get("vendor") != po_data.get("vendor"):
+    # Match vendors (canonical names, aliases and close spellings are the same vendor)
+    if not same_vendor(invoice_data.get("vendor"), po_data.get("vendor")):
         mismatches["vendor"] = {
             "invoice": invoice_data.get("vendor"),
             "po": po_data.get("vendor")
@@ -81,3 +199,171 @@ def detect_discrepancies(invoice_data: dict, po_data: dict) -> dict:
         mismatches["status"] = {"invoice": "✅ No discrepancies found!", "po": ""}
 
     return mismatches
+
+
+# ====== Columnar batch API ======
+# Invoice and PO batches are column name -> array mappings (dict of lists or
+# NumPy arrays, a pyarrow Table/RecordBatch, or a pandas DataFrame), one row
+# per pair: row i of the invoices is compared with row i of the POs.
+INVOICE_COLUMNS = ("purchase_order_reference", "invoice_number", "vendor", "total_amount", "invoice_date")
+PO_COLUMNS = ("purchase_order_id", "vendor", "total_value", "order_date")
+
+# detect_discrepancies() reads totals with .get(key, 0); a missing key is 0, an explicit null is not
+_COLUMN_DEFAULTS = {"total_amount": 0, "total_value": 0}
+_UNSET = object()
+
+
+def _safe_float(v):
+    try:
+        return float(v)
+    except Exception:
+        return _UNSET
+
+
+_truthy = np.frompyfunc(bool, 1, 1)
+_is_set = np.frompyfunc(lambda v: v is not _UNSET, 1, 1)
+_as_date_key = np.frompyfunc(lambda v: v if isinstance(v, str) else "", 1, 1)
+_to_float = np.frompyfunc(_safe_float, 1, 1)
+_different_vendor = np.frompyfunc(lambda a, b: not same_vendor(a, b), 2, 1)
+
+
+def records_to_columns(records, columns) -> dict:
+    """Turn a list of parsed dicts into the columnar layout the batch API expects."""
+    return {c: [r.get(c, _COLUMN_DEFAULTS.get(c)) for r in records] for c in columns}
+
+
+def _batch_len(batch) -> int:
+    if hasattr(batch, "num_rows"):
+        return batch.num_rows
+    if hasattr(batch, "shape"):
+        return batch.shape[0]
+    return max((len(v) for v in batch.values()), default=0)
+
+
+def _column(batch, name: str, n: int) -> np.ndarray:
+    if hasattr(batch, "column_names"):  # pyarrow Table / RecordBatch
+        col = batch.column(name) if name in batch.column_names else None
+    else:
+        col = batch[name] if name in batch else None
+    if col is None:
+        return np.full(n, _COLUMN_DEFAULTS.get(name), dtype=object)
+    if hasattr(col, "to_pylist"):  # Arrow arrays keep nulls as None this way
+        col = col.to_pylist()
+    out = np.empty(n, dtype=object)
+    out[:] = list(col)
+    return out
+
+
+def _normalized(values: np.ndarray) -> np.ndarray:
+    return np.char.lower(np.char.strip(values.astype(str)))
+
+
+def _parse_dates(values: np.ndarray) -> np.ndarray:
+    """Parse each distinct date string once and broadcast back; unparseable -> NaT."""
+    keys = _as_date_key(values).astype(str)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    parsed = np.array(
+        [np.datetime64(d.date()) if d else np.datetime64("NaT") for d in map(parse_date_safe, unique)],
+        dtype="datetime64[D]",
+    )
+    return parsed[inverse.reshape(-1)]
+
+
+def _compare_columns(invoices, pos) -> dict:
+    n = _batch_len(invoices)
+    if _batch_len(pos) != n:
+        raise ValueError(f"Invoice and PO batches must have the same length ({n} != {_batch_len(pos)})")
+    inv = {c: _column(invoices, c, n) for c in INVOICE_COLUMNS}
+    po = {c: _column(pos, c, n) for c in PO_COLUMNS}
+
+    # Reference numbers (invoice_number is the fallback)
+    inv_ref = np.where(_truthy(inv["purchase_order_reference"]).astype(bool), inv["purchase_order_reference"], inv["invoice_number"])
+    po_ref = po["purchase_order_id"]
+    refs_present = _truthy(inv_ref).astype(bool) & _truthy(po_ref).astype(bool)
+    ref_mismatch = ~refs_present | (_normalized(inv_ref) != _normalized(po_ref))
+
+    # Dates: outside the window, or (as in detect_discrepancies) simply not identical
+    inv_date, po_date = inv["invoice_date"], po["order_date"]
+    d1, d2 = _parse_dates(inv_date), _parse_dates(po_date)
+    both_parsed = ~np.isnat(d1) & ~np.isnat(d2)
+    delta = np.where(both_parsed, np.abs((d1 - d2).astype("int64")), 0)
+    date_outside_window = both_parsed & (delta > DATE_WINDOW_DAYS)
+    dates_present = _truthy(inv_date).astype(bool) & _truthy(po_date).astype(bool)
+    date_mismatch = date_outside_window | (dates_present & (inv_date != po_date).astype(bool))
+
+    # Vendors: only pairs that differ exactly need the canonical/fuzzy comparison
+    vendor_mismatch = (inv["vendor"] != po["vendor"]).astype(bool)
+    differ = np.flatnonzero(vendor_mismatch)
+    if differ.size:
+        vendor_mismatch[differ] = _different_vendor(inv["vendor"][differ], po["vendor"][differ]).astype(bool)
+
+    # Totals: if either side fails float(), both count as 0
+    inv_conv, po_conv = _to_float(inv["total_amount"]), _to_float(po["total_value"])
+    totals_ok = _is_set(inv_conv).astype(bool) & _is_set(po_conv).astype(bool)
+    inv_total = np.where(totals_ok, inv_conv, 0.0).astype(float)
+    po_total = np.where(totals_ok, po_conv, 0.0).astype(float)
+    total_mismatch = np.abs(inv_total - po_total) > 0.01
+
+    return {
+        "n": n,
+        "inv": inv,
+        "po": po,
+        "inv_ref": inv_ref,
+        "po_ref": po_ref,
+        "refs_present": refs_present,
+        "date_outside_window": date_outside_window,
+        "inv_total": inv_total,
+        "po_total": po_total,
+        "flags": {
+            "reference_number": ref_mismatch,
+            "date": date_mismatch,
+            "vendor": vendor_mismatch,
+            "total_amount": total_mismatch,
+            "any": ref_mismatch | date_mismatch | vendor_mismatch | total_mismatch,
+        },
+    }
+
+
+def discrepancy_flags(invoices, pos) -> dict:
+    """
+    Boolean mismatch arrays (one entry per pair) for reference_number, date,
+    vendor and total_amount, plus "any". Cheap enough to count or filter
+    hundreds of thousands of pairs without building per-pair dicts.
+    """
+    return _compare_columns(invoices, pos)["flags"]
+
+
+def detect_discrepancies_batch(invoices, pos) -> list:
+    """
+    Vectorized detect_discrepancies() over columnar invoice/PO batches.
+    Returns one mismatch dict per pair, identical to calling
+    detect_discrepancies() on each row pair.
+    """
+    r = _compare_columns(invoices, pos)
+    flags = r["flags"]
+    inv, po = r["inv"], r["po"]
+    inv_ref, po_ref = r["inv_ref"], r["po_ref"]
+
+    results = []
+    for i in range(r["n"]):
+        if not flags["any"][i]:
+            results.append({"status": {"invoice": "✅ No discrepancies found!", "po": ""}})
+            continue
+
+        mismatches = {}
+        if flags["reference_number"][i]:
+            if r["refs_present"][i]:
+                mismatches["reference_number"] = {"invoice": inv_ref[i], "po": po_ref[i]}
+            else:
+                mismatches["reference_number"] = {"invoice": inv_ref[i] or "missing", "po": po_ref[i] or "missing"}
+        date_entry = {"invoice": inv["invoice_date"][i], "po": po["order_date"][i]}
+        if r["date_outside_window"][i]:
+            mismatches["date"] = date_entry
+        if flags["vendor"][i]:
+            mismatches["vendor"] = {"invoice": inv["vendor"][i], "po": po["vendor"][i]}
+        if flags["total_amount"][i]:
+            mismatches["total_amount"] = {"invoice": float(r["inv_total"][i]), "po": float(r["po_total"][i])}
+        if flags["date"][i]:
+            mismatches["date"] = date_entry
+        results.append(mismatches)
+    return results
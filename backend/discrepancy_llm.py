@@ -1,81 +1,126 @@
 # discrepancy_llm.py
-import sqlite3
+import hashlib
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+from sql_guard import QueryRejected, run_guarded
+import llm_gateway
+import query_cache
 
-load_dotenv()
-# Use env var for base_url and key; change as per Shivaay docs if needed.
-client = OpenAI(
-    api_key=os.getenv("SHIVAAY_API_KEY"),
-    base_url=os.getenv("SHIVAAY_BASE_URL", "https://api.futurixai.com/api/shivaay/v1")
-)
-
-def _clean_sql_from_model(text: str) -> str:
-    # Remove markdown fences and stray backticks
-    sql = text.replace("```sql", "").replace("```", "").strip(" \n`")
-    return sql
-
-def run_discrepancy_query(request: str):
-    """
-    Use Shivaay AI to generate a valid SQLite query to find mismatches
-    in invoice_data and po_data tables. Use json_extract for SQLite.
-    """
-
-    try:
-        prompt = f"""
-You are a SQLite SQL generator. The DB is SQLite and JSON fields must be accessed using json_extract(column, '$.key').
-There are two tables:
+SQL_PROMPT_TEMPLATE = """
+You are a SQLite SQL generator. The DB is SQLite.
+There are three tables. The common fields are stored in typed, indexed columns; always prefer them.
 
 1) invoice_data:
    - id
    - filename
-   - parsed_data (JSON with keys: invoice_number, vendor, purchase_order_reference, total_amount, invoice_date)
+   - invoice_number (TEXT)
+   - purchase_order_reference (TEXT)
+   - vendor (TEXT)
+   - total_amount (REAL)
+   - invoice_date (DATE, 'YYYY-MM-DD')
+   - parsed_data (full parsed JSON)
 
 2) po_data:
    - id
    - filename
-   - parsed_data (JSON with keys: purchase_order_id, vendor, total_value, order_date)
+   - purchase_order_id (TEXT)
+   - vendor (TEXT)
+   - total_value (REAL)
+   - order_date (DATE, 'YYYY-MM-DD')
+   - parsed_data (full parsed JSON)
+
+3) reconciliation_status (current comparison result per invoice/PO pair):
+   - invoice_id (invoice_data.id)
+   - po_id (po_data.id)
+   - matched_on (TEXT: 'reference', 'vendor' or 'manual')
+   - has_discrepancies (BOOLEAN, 0/1)
+   - discrepancy_fields (JSON list of field names that differ)
+   - evaluated_at (DATETIME)
 
 Write a SINGLE valid SQLite SQL query (no explanation, no markdown fences) to satisfy this request:
-\"{request}\"
+"{request}"
 
 Important:
-- Use json_extract(parsed_data, '$.<key>') to extract values.
-- Cast numeric fields where needed: CAST(json_extract(... ) AS REAL)
-- Join invoice_data and po_data by purchase_order_reference == purchase_order_id (where appropriate).
+- Use the columns above directly; only use json_extract(parsed_data, '$.<key>') for keys that have no column.
+- Join invoice_data and po_data on invoice_data.purchase_order_reference = po_data.purchase_order_id (where appropriate).
+- For "which invoices/POs have discrepancies" prefer reconciliation_status over comparing the tables.
 Return only the SQL query text.
 """
 
-        completion = client.chat.completions.create(
-            model=os.getenv("SHIVAAY_MODEL", "shivaay"),
-            messages=[
-                {"role": "system", "content": "You are an expert SQLite query generator. Output only the SQL query."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.0,
-            max_tokens=512
-        )
+SQL_SYSTEM_PROMPT = "You are an expert SQLite query generator. Output only the SQL query."
 
-        raw_sql = completion.choices[0].message.content
-        sql_query = _clean_sql_from_model(raw_sql)
+def _clean_sql_from_model(text: str) -> str:
+    # Remove markdown fences and stray backticks
+    sql = text.replace("```sql", "").replace("```", "").strip(" \n`")
+    return sql
 
-        # Safety: very small whitelist check (ensure it starts with SELECT)
-        if not sql_query.lower().strip().startswith("select"):
-            return {"error": "Model did not return a SELECT query.", "sql": sql_query}
+def _prompt_version() -> str:
+    """Cached SQL is only reused for the same prompt and model."""
+    model = os.getenv("SHIVAAY_MODEL", "shivaay")
+    return hashlib.sha256(f"{model}\n{SQL_SYSTEM_PROMPT}\n{SQL_PROMPT_TEMPLATE}".encode("utf-8")).hexdigest()
+
+def _generate_sql(request: str) -> str:
+    raw_sql = llm_gateway.chat(
+        [
+            {"role": "system", "content": SQL_SYSTEM_PROMPT},
+            {"role": "user", "content": SQL_PROMPT_TEMPLATE.format(request=request)}
+        ],
+        temperature=0.0,
+        max_tokens=512
+    )
+    return _clean_sql_from_model(raw_sql)
+
+def _result(sql_query: str, params: dict, rows, truncated: bool = False) -> dict:
+    result = {"sql": sql_query, "rows": rows}
+    if params:
+        result["params"] = params
+    if truncated:
+        result["truncated"] = True
+    return result
 
-        conn = sqlite3.connect("verifin.db")
-        cursor = conn.cursor()
+def run_discrepancy_query(request: str):
+    """
+    Use Shivaay AI to generate a valid SQLite query to find mismatches
+    in invoice_data and po_data tables, using their promoted columns.
+    SQL for previously seen requests (or request templates) and results
+    for unchanged data are served from query_cache. Queries run through
+    sql_guard (plan check, time budget, row cap) on a read-only connection.
+    """
 
+    try:
+        prompt_version = _prompt_version()
+        cached_sql = query_cache.lookup_sql(request, prompt_version)
+        if cached_sql is not None:
+            sql_query, params = cached_sql
+        else:
+            sql_query, params = _generate_sql(request), {}
+
+            # Safety: very small whitelist check (ensure it starts with SELECT)
+            if not sql_query.lower().strip().startswith("select"):
+                return {"error": "Model did not return a SELECT query.", "sql": sql_query}
+
+        version = query_cache.data_version()
+        result_key = query_cache.result_key(sql_query, params, version)
+        cached = query_cache.result_cache.get(result_key)
+        if cached is not None:
+            # Identical SQL already ran for another request; still remember this request's SQL
+            if cached_sql is None:
+                query_cache.store_sql(request, prompt_version, sql_query)
+            return _result(sql_query, params, *cached)
+
+        truncated = False
         try:
-            cursor.execute(sql_query)
-            rows = cursor.fetchall()
+            guarded = run_guarded(sql_query, params)
+        except QueryRejected as e:
+            return {"error": str(e), "sql": sql_query}
         except Exception as e:
             rows = [("SQL error", str(e))]
+        else:
+            rows, truncated = guarded["rows"], guarded["truncated"]
+            if cached_sql is None:
+                query_cache.store_sql(request, prompt_version, sql_query)
+            query_cache.result_cache.put(result_key, (rows, truncated))
 
-        conn.close()
-
-        return {"sql": sql_query, "rows": rows}
+        return _result(sql_query, params, rows, truncated)
 
     except Exception as e:
         return {"error": str(e)}
@@ -0,0 +1,488 @@
+# extraction.py  – single bytes-first text extraction engine
+#
+# Every upload goes through extract_text(): the format is detected from its
+# magic bytes, PDFs are read with a pluggable text-layer backend (pdfplumber
+# or pypdfium2, chosen per document by measured speed) and pages or images
+# without usable text fall back to Tesseract (ocr.py).
+import io
+import mmap
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Optional
+
+import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from PIL import Image, ImageSequence
+
+import ocr
+from chunking import PAGE_BREAK
+from metrics import EXTRACTION_DOCUMENTS, OCR_PAGES, STAGE_SECONDS, stage_timer
+
+# "auto" picks the fastest text-layer backend per document; a backend name pins it.
+PDF_BACKEND = os.getenv("VERIFIN_PDF_BACKEND", "auto").lower()
+
+# A text layer shorter than this on a page that carries images is treated as
+# a scan with a stray overlay (page number, stamp) and OCR'd instead.
+MIN_TEXT_LAYER_CHARS = 16
+
+# Backend selection: every backend is measured this many times before the
+# fastest wins, and one document in EXPLORE_EVERY re-measures the others.
+MIN_BACKEND_SAMPLES = 3
+EXPLORE_EVERY = 50
+EWMA_ALPHA = 0.2
+
+_SIGNATURES = (
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+# PDFium is not thread-safe; parse jobs run on a thread pool.
+_PDFIUM_LOCK = threading.Lock()
+
+
+# ---------- Input handling ----------
+class _MmapReader(io.RawIOBase):
+    """Read-only stream over an mmap (pypdfium2 needs readinto, which mmap lacks)."""
+
+    def __init__(self, mm):
+        self._mm = mm
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._mm)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        chunk = self._mm[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
+def _head(data, size: int = 1024) -> bytes:
+    if hasattr(data, "read") and not isinstance(data, mmap.mmap):
+        data.seek(0)
+        head = data.read(size)
+        data.seek(0)
+        return head
+    return bytes(data[:size])
+
+
+def _as_stream(data):
+    """
+    Wrap document data as a seekable stream without copying it.
+    mmap objects (and open files) are already streams; bytes are shared by BytesIO.
+    """
+    if hasattr(data, "read") and hasattr(data, "seek"):
+        data.seek(0)
+        return data
+    return io.BytesIO(data)
+
+
+def _to_bytes(data) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, mmap.mmap):
+        return data[:]
+    return _as_stream(data).read()
+
+
+def detect_format(data) -> str:
+    """Format from the leading bytes: pdf, tiff, png, jpeg, gif, bmp, webp or unknown."""
+    head = _head(data)
+    # The PDF header may follow some junk, anywhere in the first kilobyte.
+    if b"%PDF-" in head:
+        return "pdf"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, fmt in _SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return "unknown"
+
+
+# ---------- PDF text-layer backends ----------
+class PdfplumberDocument:
+    def __init__(self, source):
+        self._pdf = pdfplumber.open(source if isinstance(source, str) else _as_stream(source))
+        self.page_count = len(self._pdf.pages)
+
+    def page_text(self, index: int) -> str:
+        return self._pdf.pages[index].extract_text() or ""
+
+    def has_images(self, index: int) -> bool:
+        return bool(self._pdf.pages[index].images)
+
+    def render(self, index: int, dpi: int):
+        with _PDFIUM_LOCK:
+            return self._pdf.pages[index].to_image(resolution=dpi).original
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+class PdfiumDocument:
+    def __init__(self, source):
+        if isinstance(source, mmap.mmap):
+            source = _MmapReader(source)
+        elif not isinstance(source, (str, bytes)) and hasattr(source, "seek"):
+            source.seek(0)
+        with _PDFIUM_LOCK:
+            self._pdf = pdfium.PdfDocument(source)
+            self.page_count = len(self._pdf)
+
+    def page_text(self, index: int) -> str:
+        with _PDFIUM_LOCK:
+            page = self._pdf[index]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+        return text.replace("\r\n", "\n")
+
+    def has_images(self, index: int) -> bool:
+        with _PDFIUM_LOCK:
+            page = self._pdf[index]
+            try:
+                return any(True for _ in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]))
+            finally:
+                page.close()
+
+    def render(self, index: int, dpi: int):
+        with _PDFIUM_LOCK:
+            page = self._pdf[index]
+            try:
+                return page.render(scale=dpi / 72).to_pil()
+            finally:
+                page.close()
+
+    def close(self) -> None:
+        with _PDFIUM_LOCK:
+            self._pdf.close()
+
+
+# name -> document class taking a path, bytes, mmap or stream. Register more here.
+TEXT_BACKENDS = {
+    "pypdfium2": PdfiumDocument,
+    "pdfplumber": PdfplumberDocument,
+}
+
+
+class _BackendTimer:
+    """Moving average of text-layer seconds per page for each backend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds_per_page = {}
+        self._samples = {}
+        self._documents = 0
+
+    def choose(self, names) -> str:
+        with self._lock:
+            self._documents += 1
+            for name in names:
+                if self._samples.get(name, 0) < MIN_BACKEND_SAMPLES:
+                    return name
+            if self._documents % EXPLORE_EVERY == 0:
+                return random.choice(names)
+            return min(names, key=lambda name: self._seconds_per_page[name])
+
+    def record(self, name: str, seconds: float, pages: int) -> None:
+        per_page = seconds / max(pages, 1)
+        with self._lock:
+            previous = self._seconds_per_page.get(name)
+            self._seconds_per_page[name] = (
+                per_page if previous is None else previous + EWMA_ALPHA * (per_page - previous)
+            )
+            self._samples[name] = self._samples.get(name, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {"seconds_per_page": round(value, 6), "samples": self._samples[name]}
+                for name, value in self._seconds_per_page.items()
+            }
+
+
+_backend_timer = _BackendTimer()
+
+
+def backend_stats() -> dict:
+    """Measured seconds per page for each text-layer backend in this process."""
+    return _backend_timer.snapshot()
+
+
+def _open_pdf(source, backend: Optional[str] = None):
+    """Open with the requested (or fastest) backend, falling back to the others."""
+    backend = backend or PDF_BACKEND
+    names = list(TEXT_BACKENDS)
+    first = _backend_timer.choose(names) if backend == "auto" else backend
+    errors = []
+    for name in [first] + [n for n in names if n != first]:
+        try:
+            return name, TEXT_BACKENDS[name](source)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    raise ValueError("; ".join(errors))
+
+
+# ---------- OCR ----------
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+# Forking a threaded server copies whatever locks other threads hold (e.g.
+# _PDFIUM_LOCK mid-render) into the child, which then deadlocks; start
+# workers from a clean forkserver (spawn where that is unavailable).
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Lazily create (or resize) the shared OCR process pool."""
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT)
+            _pool_size = workers
+        return _pool
+
+
+def _ocr_pdf_page(source, backend: str, page_index: int, regions=None, adaptive: bool = False):
+    """
+    Rasterize and OCR a single page. Runs inside an OCR worker process, so it
+    returns (text, seconds, method) for the parent to record. source is the
+    file path, or the document bytes when there is no file.
+    """
+    start = time.perf_counter()
+    document = TEXT_BACKENDS[backend](source)
+    try:
+        text, method = ocr.ocr_render(lambda dpi: document.render(page_index, dpi), regions, adaptive)
+    finally:
+        document.close()
+    return text, time.perf_counter() - start, method
+
+
+def _needs_ocr(document, index: int, page_text: str) -> bool:
+    """No text layer, or only a few characters of overlay on a scanned image."""
+    if not page_text:
+        return True
+    return len(page_text.strip()) < MIN_TEXT_LAYER_CHARS and document.has_images(index)
+
+
+def _ocr_regions(index: int, page_count: int, adaptive: bool):
+    """(skip, regions) for a scanned page; adaptive mode skips middle pages."""
+    if not adaptive:
+        return False, None
+    regions = ocr.page_regions(index, page_count)
+    return regions is None, regions
+
+
+# ---------- PDF page loop ----------
+def _timed_page_text(document, index: int) -> str:
+    with stage_timer("pdf_text_extraction"):
+        return document.page_text(index)
+
+
+def _extract_pdf_sequential(document, max_chars: Optional[int], adaptive: bool) -> tuple:
+    """Returns (text, seconds spent reading the text layer, pages whose text layer was read)."""
+    text, text_seconds, pages_read = "", 0.0, 0
+    for i in range(document.page_count):
+        if i:
+            text += PAGE_BREAK
+        started = time.perf_counter()
+        page_text = _timed_page_text(document, i)
+        text_seconds += time.perf_counter() - started
+        pages_read += 1
+        if _needs_ocr(document, i, page_text):
+            skip, regions = _ocr_regions(i, document.page_count, adaptive)
+            if skip:
+                print(f"[OCR] Page {i + 1}: scanned middle page, skipped in adaptive mode.")
+                OCR_PAGES.inc(method="skipped")
+                continue
+            # Fallback OCR for scanned pages
+            print(f"[OCR] Page {i + 1}: no usable embedded text, using Tesseract fallback.")
+            with stage_timer("ocr_page"):
+                page_text, method = ocr.ocr_render(lambda dpi: document.render(i, dpi), regions, adaptive)
+            OCR_PAGES.inc(method=method)
+        else:
+            OCR_PAGES.inc(method="text_layer")
+        text += page_text or ""
+        if max_chars is not None and len(text) >= max_chars:
+            print(f"[OCR] Character budget reached after page {i + 1}, skipping the rest.")
+            break
+    return text, text_seconds, pages_read
+
+
+def _extract_pdf_parallel(document, backend: str, source, max_chars: Optional[int],
+                          workers: int, adaptive: bool) -> tuple:
+    """
+    Text-layer pages are read in-process; scanned pages are fanned out to the
+    OCR pool. A window of in-flight pages is consumed strictly in page order so
+    the output matches the sequential path and OCR can stop once the budget fills.
+    Returns (text, text-layer seconds, pages whose text layer was read).
+    """
+    pool = _get_pool(workers)
+    window = deque()
+    text, text_seconds, pages_read = "", 0.0, 0
+
+    def _consume_head() -> str:
+        item = window.popleft()
+        if not isinstance(item, Future):
+            return item
+        page_text, seconds, method = item.result()
+        STAGE_SECONDS.observe(seconds, stage="ocr_page")
+        OCR_PAGES.inc(method=method)
+        return page_text
+
+    def _cancel_pending() -> None:
+        for item in window:
+            if isinstance(item, Future):
+                item.cancel()
+        window.clear()
+
+    for i in range(document.page_count):
+        if i:
+            window.append(PAGE_BREAK)
+        started = time.perf_counter()
+        page_text = _timed_page_text(document, i)
+        text_seconds += time.perf_counter() - started
+        pages_read += 1
+        if not _needs_ocr(document, i, page_text):
+            OCR_PAGES.inc(method="text_layer")
+            window.append(page_text)
+        else:
+            skip, regions = _ocr_regions(i, document.page_count, adaptive)
+            if skip:
+                print(f"[OCR] Page {i + 1}: scanned middle page, skipped in adaptive mode.")
+                OCR_PAGES.inc(method="skipped")
+                continue
+            print(f"[OCR] Page {i + 1}: no usable embedded text, queued for parallel Tesseract.")
+            window.append(pool.submit(_ocr_pdf_page, source, backend, i, regions, adaptive))
+
+        # Drain finished pages from the head, blocking only when the window is full.
+        while window and (len(window) >= workers * 2 or not isinstance(window[0], Future) or window[0].done()):
+            text += _consume_head() or ""
+            if max_chars is not None and len(text) >= max_chars:
+                print(f"[OCR] Character budget reached at page {i + 1}, skipping the rest.")
+                _cancel_pending()
+                return text, text_seconds, pages_read
+
+    while window:
+        text += _consume_head() or ""
+        if max_chars is not None and len(text) >= max_chars:
+            _cancel_pending()
+            break
+    return text, text_seconds, pages_read
+
+
+def _extract_pdf(data, source_path: Optional[str], max_chars, workers: int, adaptive: bool,
+                 backend: Optional[str]) -> tuple:
+    name, document = _open_pdf(source_path or data, backend)
+    try:
+        if workers > 1:
+            # Workers reopen the file by path; without one they get a copy of the bytes.
+            source = source_path or _to_bytes(data)
+            text, text_seconds, pages_read = _extract_pdf_parallel(document, name, source, max_chars, workers,
+                                                                   adaptive)
+        else:
+            text, text_seconds, pages_read = _extract_pdf_sequential(document, max_chars, adaptive)
+        # Per page actually read: a budget-truncated document must not look cheap
+        _backend_timer.record(name, text_seconds, pages_read)
+    finally:
+        document.close()
+    return text, name
+
+
+# ---------- Images (including multi-frame TIFF) ----------
+def _extract_image(data, max_chars, adaptive: bool) -> str:
+    image = Image.open(_as_stream(data))
+    frame_count = getattr(image, "n_frames", 1)
+    text = ""
+    for i, frame in enumerate(ImageSequence.Iterator(image)):
+        if i:
+            text += PAGE_BREAK
+        skip, regions = _ocr_regions(i, frame_count, adaptive)
+        if skip:
+            OCR_PAGES.inc(method="skipped")
+            continue
+        with stage_timer("ocr_page"):
+            frame_text, method = ocr.ocr_render(ocr.image_renderer(frame.copy()), regions, adaptive)
+        OCR_PAGES.inc(method=method)
+        text += frame_text or ""
+        if max_chars is not None and len(text) >= max_chars:
+            break
+    return text
+
+
+# ---------- Public API ----------
+def extract_text(
+    data,
+    max_chars: Optional[int] = None,
+    workers: Optional[int] = None,
+    mode: Optional[str] = None,
+    backend: Optional[str] = None,
+    source_path: Optional[str] = None,
+) -> str:
+    """
+    Extract text from a document given as bytes, an mmap or a seekable binary
+    stream. The format comes from the magic bytes, not the filename.
+
+    Pages (and image frames) are separated by chunking.PAGE_BREAK. max_chars
+    stops extraction once that many characters are collected (pages are
+    always added whole). workers > 1 OCRs scanned PDF pages across a
+    process pool; defaults to VERIFIN_OCR_WORKERS. mode is "full" or
+    "adaptive" (see ocr.OCR_MODE). backend pins the PDF text-layer backend
+    ("pdfplumber", "pypdfium2"); by default the fastest measured one is used.
+    source_path, when the data came from a file, lets backends and OCR
+    workers open the file directly.
+    """
+    workers = ocr.OCR_WORKERS if workers is None else workers
+    adaptive = (mode or ocr.OCR_MODE) == "adaptive"
+    fmt = detect_format(data)
+    try:
+        if fmt == "pdf":
+            text, used = _extract_pdf(data, source_path, max_chars, workers, adaptive, backend)
+        elif fmt != "unknown":
+            text, used = _extract_image(data, max_chars, adaptive), "tesseract"
+        else:
+            print(f"[EXTRACT] Unrecognized document format: {source_path or 'upload'}")
+            return ""
+    except Exception as e:
+        print(f"[EXTRACT ERROR] Could not read {source_path or 'upload'} ({fmt}): {e}")
+        return ""
+    EXTRACTION_DOCUMENTS.inc(format=fmt, backend=used)
+    return text.strip()
+
+
+def extract_file(file_path: str, **kwargs) -> str:
+    """extract_text() over a memory map of file_path, so the upload is never copied."""
+    if os.path.getsize(file_path) == 0:
+        return ""
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return extract_text(mm, source_path=file_path, **kwargs)
@@ -0,0 +1,453 @@
+# field_extractor.py  – rule-based fast path for invoice / PO header fields
+#
+# Runs before the LLM. Generic labelled-field regexes cover well-structured
+# documents; per-vendor templates learned from earlier LLM parses (the label
+# each field sat next to in that vendor's documents) cover fixed layouts with
+# unusual labels. A result is only returned when every required field was
+# found with enough confidence, otherwise the caller asks the LLM.
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Optional
+
+from db import SessionLocal
+from models import InvoiceData, POData
+
+RULES_ENABLED = os.getenv("VERIFIN_RULE_EXTRACTION", "1") != "0"
+MIN_CONFIDENCE = float(os.getenv("VERIFIN_RULES_MIN_CONFIDENCE", "0.8"))
+TEMPLATE_REFRESH_SECONDS = int(os.getenv("VERIFIN_TEMPLATE_REFRESH_SECONDS", "300"))
+TEMPLATE_MAX_ROWS = int(os.getenv("VERIFIN_TEMPLATE_MAX_ROWS", "2000"))
+
+# A learned label must appear in at least this many of a vendor's documents,
+# and in this share of them, before it is trusted.
+MIN_TEMPLATE_DOCS = 2
+MIN_TEMPLATE_AGREEMENT = 0.6
+MAX_LABEL_CHARS = 40
+
+TEMPLATE_CONFIDENCE = 0.95
+SAME_LINE_CONFIDENCE = 0.85
+NEXT_LINE_CONFIDENCE = 0.75
+
+# Generic field -> parsed_data keys, per document kind
+FIELD_KEYS = {
+    "invoice": {
+        "number": "invoice_number",
+        "po_reference": "purchase_order_reference",
+        "vendor": "vendor",
+        "total": "total_amount",
+        "date": "invoice_date",
+    },
+    "po": {
+        "number": "purchase_order_id",
+        "vendor": "vendor",
+        "total": "total_value",
+        "date": "order_date",
+    },
+}
+PARSED_KEYS = (
+    "invoice_number", "vendor", "purchase_order_reference", "total_amount", "invoice_date",
+    "purchase_order_id", "total_value", "order_date",
+)
+
+# ---------- Generic patterns ----------
+_ID = r"([A-Z0-9][A-Z0-9\-/_.]*\d[A-Z0-9\-/_.]*)"
+_AMOUNT = r"(\d[\d,]*(?:\.\d{1,2})?)"
+_DATE_TOKEN = re.compile(
+    r"\d{4}-\d{1,2}-\d{1,2}"
+    r"|\d{1,2}[/.-]\d{1,2}[/.-]\d{4}"
+    r"|\d{1,2}\s+[A-Za-z]{3,9}\.?,?\s+\d{4}"
+    r"|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}"
+)
+
+# A whole-word "PO" / "P.O." / "Purchase Order" label (not "Pod-1", "Pos1234" or "PO Box 12")
+_PO_LABEL = r"\b(?:p\.?[ \t]?o\b\.?|purchase[ \t]+order\b)(?!\.?[ \t]*box\b)"
+
+# _PATTERNS capture the value in "Label: value" on one line; _LABEL_ONLY
+# matches a label that ends its line, with the value on the next line.
+_PATTERNS = {
+    "invoice_number": re.compile(r"\binv(?:oice)?\.?[ \t]*(?:no\.?|number|num|#|id)[ \t]*[:#]?[ \t]*" + _ID, re.I),
+    "po_number": re.compile(
+        _PO_LABEL + r"[ \t]*(?:no\.?|number|num|#|id|ref(?:erence)?)?[ \t]*[:#]?[ \t]*" + _ID,
+        re.I,
+    ),
+    "vendor": re.compile(
+        r"^[ \t]*(?:vendor|supplier|seller|sold[ \t]+by|bill[ \t]+from|remit[ \t]+to|from)(?:[ \t]+name)?"
+        r"[ \t]*[:\-][ \t]*(.+?)[ \t]*$",
+        re.I | re.M,
+    ),
+    "total": re.compile(
+        r"^[ \t]*(grand[ \t]+total|amount[ \t]+due|balance[ \t]+due|total[ \t]+due|total[ \t]+amount"
+        r"|invoice[ \t]+total|order[ \t]+total|total[ \t]+value"
+        r"|total(?![ \t]*(?:tax|vat|gst|qty|quantity|items?|units|discount|weight)))\b[^\d\n]{0,20}?" + _AMOUNT,
+        re.I | re.M,
+    ),
+    "date": re.compile(
+        r"^[ \t]*(?:invoice[ \t]+date|order[ \t]+date|po[ \t]+date|issue[ \t]+date|date[ \t]+of[ \t]+issue|dated?)"
+        r"[ \t]*[:\-]?[ \t]*(.+?)[ \t]*$",
+        re.I | re.M,
+    ),
+}
+_LABEL_ONLY = {
+    "invoice_number": re.compile(r"^\s*inv(?:oice)?\.?\s*(?:no\.?|number|num|#)\s*[:#]?\s*$", re.I),
+    "po_number": re.compile(r"^\s*(?:p\.?\s?o\.?|purchase\s+order)\s*(?:no\.?|number|num|#|id)\s*[:#]?\s*$", re.I),
+    "vendor": re.compile(r"^\s*(?:vendor|supplier|seller|sold\s+by|bill\s+from)(?:\s+name)?\s*:?\s*$", re.I),
+    "total": re.compile(r"^\s*(?:grand\s+total|amount\s+due|balance\s+due|total\s+amount|total)\s*:?\s*$", re.I),
+    "date": re.compile(r"^\s*(?:invoice\s+date|order\s+date|po\s+date|issue\s+date|date)\s*:?\s*$", re.I),
+}
+# Later entries win: "grand total" beats a plain "total" line.
+_TOTAL_PRIORITY = ("total", "total value", "order total", "invoice total", "total amount",
+                   "total due", "balance due", "amount due", "grand total")
+_MENTIONS_PO = re.compile(_PO_LABEL, re.I)
+_LETTERS = re.compile(r"[A-Za-z]")
+
+
+# ---------- Value parsing ----------
+def _parse_amount(value: str) -> Optional[float]:
+    match = re.search(_AMOUNT, value or "")
+    if not match:
+        return None
+    try:
+        amount = float(match.group(1).replace(",", ""))
+    except ValueError:
+        return None
+    return amount if amount > 0 else None
+
+
+def _parse_date(value: str) -> Optional[str]:
+    """First unambiguous date in value, as YYYY-MM-DD."""
+    match = _DATE_TOKEN.search(value or "")
+    if not match:
+        return None
+    token = re.sub(r"\s+", " ", match.group(0).replace(",", "").replace(".", " ")).strip()
+    numeric = re.fullmatch(r"(\d{1,2})[/ -](\d{1,2})[/ -](\d{4})", token)
+    if numeric:
+        first, second, year = (int(g) for g in numeric.groups())
+        if "/" in token and first <= 12 and second <= 12 and first != second:
+            return None  # 03/04/2024 could be either order; leave it to the LLM
+        day, month = (second, first) if "/" in token and second > 12 else (first, second)
+        try:
+            return datetime(year, month, day).strftime("%Y-%m-%d")
+        except ValueError:
+            return None
+    for fmt in ("%Y-%m-%d", "%d %B %Y", "%d %b %Y", "%B %d %Y", "%b %d %Y"):
+        try:
+            return datetime.strptime(token, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_id(value: str) -> Optional[str]:
+    match = re.match(r"\s*[:#]?\s*" + _ID, value or "", re.I)
+    return match.group(1).rstrip(".") if match else None
+
+
+def _parse_vendor(value: str) -> Optional[str]:
+    value = (value or "").strip(" :-\t")
+    return value if 2 <= len(value) <= 120 and _LETTERS.search(value) else None
+
+
+_PARSERS = {
+    "number": _parse_id,
+    "po_reference": _parse_id,
+    "vendor": _parse_vendor,
+    "total": _parse_amount,
+    "date": _parse_date,
+}
+
+
+def _lines(text: str) -> list:
+    return [line.strip() for line in text.splitlines()]
+
+
+def _next_value(lines: list, index: int) -> Optional[str]:
+    for line in lines[index + 1:index + 3]:
+        if line:
+            return line
+    return None
+
+
+def document_kind(text: str) -> Optional[str]:
+    """'invoice' or 'po' from the document title (the first short line naming either)."""
+    for line in _lines(text)[:15]:
+        lowered = line.lower()
+        if not line or len(line) > 60:
+            continue
+        if "purchase order" in lowered and "invoice" not in lowered:
+            return "po"
+        if "invoice" in lowered:
+            return "invoice"
+    return None
+
+
+# ---------- Generic extraction ----------
+def _generic_fields(text: str, kind: str) -> dict:
+    """field -> (value, confidence) from the generic label patterns."""
+    fields = {}
+    lines = _lines(text)
+
+    def _same_line(name, parse):
+        for match in _PATTERNS[name].finditer(text):
+            value = parse(match.group(1))
+            if value:
+                return value
+        return None
+
+    def _label_line(name, parse):
+        for i, line in enumerate(lines):
+            if _LABEL_ONLY[name].match(line):
+                value = parse(_next_value(lines, i))
+                if value:
+                    return value
+        return None
+
+    def _set(field, name, parse):
+        value = _same_line(name, parse)
+        if value:
+            fields[field] = (value, SAME_LINE_CONFIDENCE)
+            return
+        value = _label_line(name, parse)
+        if value:
+            fields[field] = (value, NEXT_LINE_CONFIDENCE)
+
+    number_pattern = "invoice_number" if kind == "invoice" else "po_number"
+    _set("number", number_pattern, _parse_id)
+    if kind == "invoice":
+        _set("po_reference", "po_number", _parse_id)
+    _set("vendor", "vendor", _parse_vendor)
+    _set("date", "date", _parse_date)
+
+    # Totals: the strongest label wins, and the last occurrence of it (the summary block).
+    best = None
+    for match in _PATTERNS["total"].finditer(text):
+        amount = _parse_amount(match.group(2))
+        label = re.sub(r"\s+", " ", match.group(1).lower())
+        rank = _TOTAL_PRIORITY.index(label) if label in _TOTAL_PRIORITY else 0
+        if amount and (best is None or rank >= best[0]):
+            best = (rank, amount)
+    if best:
+        fields["total"] = (best[1], SAME_LINE_CONFIDENCE)
+    else:
+        value = _label_line("total", _parse_amount)
+        if value:
+            fields["total"] = (value, NEXT_LINE_CONFIDENCE)
+    return fields
+
+
+# ---------- Relevance cues ----------
+def field_cues(text: str) -> dict:
+    """
+    How likely a piece of text is to hold each generic field: 2 for a labelled
+    value on one line, 1 for a bare label (or an unlabelled date) whose value
+    may be nearby, 0 otherwise. Cheap enough to score every page of a long
+    document before deciding which parts go to the LLM.
+    """
+    lines = _lines(text)
+
+    def _label(*names):
+        return any(_LABEL_ONLY[name].match(line) for name in names for line in lines)
+
+    def _score(labelled: bool, label: bool) -> int:
+        return 2 if labelled else 1 if label else 0
+
+    return {
+        "number": _score(
+            bool(_PATTERNS["invoice_number"].search(text) or _PATTERNS["po_number"].search(text)),
+            _label("invoice_number", "po_number"),
+        ),
+        "vendor": _score(bool(_PATTERNS["vendor"].search(text)), _label("vendor")),
+        "total": _score(bool(_PATTERNS["total"].search(text)), _label("total")),
+        "date": _score(bool(_PATTERNS["date"].search(text)), bool(_DATE_TOKEN.search(text))),
+    }
+
+
+# ---------- Vendor templates ----------
+class _Template:
+    def __init__(self, vendor: str, kind: str, rules: dict):
+        self.vendor = vendor
+        self.kind = kind
+        self.needle = vendor.lower()
+        # field -> (position, label, compiled pattern)
+        self.rules = {
+            field: (position, label, _template_pattern(position, label))
+            for field, (position, label) in rules.items()
+        }
+
+    def extract(self, text: str) -> dict:
+        fields = {"vendor": (self.vendor, TEMPLATE_CONFIDENCE)}
+        for field, (_, _, pattern) in self.rules.items():
+            match = pattern.search(text)
+            value = _PARSERS[field](match.group(1)) if match else None
+            if value:
+                fields[field] = (value, TEMPLATE_CONFIDENCE)
+        return fields
+
+
+def _template_pattern(position: str, label: str):
+    if position == "same_line":
+        return re.compile(r"^[ \t]*" + re.escape(label) + r"[ \t]*(.+?)[ \t]*$", re.M)
+    return re.compile(r"^[ \t]*" + re.escape(label) + r"[ \t]*\n\s*(.+?)[ \t]*$", re.M)
+
+
+def _value_variants(field: str, value) -> list:
+    if value in (None, ""):
+        return []
+    if field == "total":
+        try:
+            amount = float(value)
+        except (TypeError, ValueError):
+            return []
+        variants = [f"{amount:,.2f}", f"{amount:.2f}"]
+        if amount == int(amount):
+            variants += [f"{int(amount):,}", str(int(amount))]
+        return variants
+    return [str(value).strip()]
+
+
+def _locate_label(lines: list, field: str, value) -> Optional[tuple]:
+    """(position, label) of the line holding value in one document, if any."""
+    target_date = _parse_date(str(value)) if field == "date" and value else None
+    for i, line in enumerate(lines):
+        start = -1
+        if field == "date":
+            for match in _DATE_TOKEN.finditer(line):
+                if target_date and _parse_date(match.group(0)) == target_date:
+                    start = match.start()
+                    break
+        else:
+            for variant in _value_variants(field, value):
+                start = line.find(variant)
+                if start != -1:
+                    break
+        if start == -1:
+            continue
+        prefix = line[:start].strip()
+        if prefix:
+            if len(prefix) <= MAX_LABEL_CHARS and _LETTERS.search(prefix):
+                return "same_line", prefix
+            return None
+        previous = next((l for l in reversed(lines[:i]) if l), "")
+        if previous and len(previous) <= MAX_LABEL_CHARS and _LETTERS.search(previous):
+            return "next_line", previous
+        return None
+    return None
+
+
+def learn_templates(rows) -> list:
+    """
+    Build vendor templates from (kind, raw_text, parsed dict) rows of earlier
+    LLM parses. A field's label is kept when the same label sat next to the
+    parsed value in enough of that vendor's documents.
+    """
+    observations = defaultdict(lambda: defaultdict(Counter))
+    documents = Counter()
+    display_names = defaultdict(Counter)
+    for kind, raw_text, parsed in rows:
+        vendor = _parse_vendor(str(parsed.get("vendor") or ""))
+        if not vendor or not raw_text:
+            continue
+        key = (vendor.lower(), kind)
+        documents[key] += 1
+        display_names[key][vendor] += 1
+        lines = _lines(raw_text)
+        for field, parsed_key in FIELD_KEYS[kind].items():
+            if field == "vendor":
+                continue
+            located = _locate_label(lines, field, parsed.get(parsed_key))
+            if located:
+                observations[key][field][located] += 1
+
+    templates = []
+    for key, fields in observations.items():
+        rules = {}
+        for field, counts in fields.items():
+            (position, label), seen = counts.most_common(1)[0]
+            if seen >= MIN_TEMPLATE_DOCS and seen / documents[key] >= MIN_TEMPLATE_AGREEMENT:
+                rules[field] = (position, label)
+        if rules:
+            vendor = display_names[key].most_common(1)[0][0]
+            templates.append(_Template(vendor, key[1], rules))
+    return templates
+
+
+_templates = []
+_templates_loaded_at = 0.0
+_templates_lock = threading.Lock()
+
+
+def _load_rows() -> list:
+    rows = []
+    db = SessionLocal()
+    try:
+        for kind, model in (("invoice", InvoiceData), ("po", POData)):
+            query = (
+                db.query(model.raw_text, model.parsed_data)
+                .filter(model.parse_source == "llm", model.raw_text.isnot(None), model.raw_text != "")
+                .order_by(model.id.desc())
+                .limit(TEMPLATE_MAX_ROWS)
+            )
+            for raw_text, parsed_data in query:
+                try:
+                    parsed = json.loads(parsed_data or "{}")
+                except ValueError:
+                    continue
+                if isinstance(parsed, dict):
+                    rows.append((kind, raw_text, parsed))
+    finally:
+        db.close()
+    return rows
+
+
+def get_templates(force: bool = False) -> list:
+    """Vendor templates, relearned from the database every TEMPLATE_REFRESH_SECONDS."""
+    global _templates, _templates_loaded_at
+    with _templates_lock:
+        if force or time.monotonic() - _templates_loaded_at > TEMPLATE_REFRESH_SECONDS:
+            try:
+                _templates = learn_templates(_load_rows())
+            except Exception as e:
+                print(f"[RULES] Could not learn vendor templates: {e}")
+            _templates_loaded_at = time.monotonic()
+        return _templates
+
+
+def _match_template(text: str, kind: str) -> Optional[_Template]:
+    head = text[:2000].lower()
+    matches = [t for t in get_templates() if t.kind == kind and t.needle in head]
+    return max(matches, key=lambda t: len(t.needle)) if matches else None
+
+
+# ---------- Entry point ----------
+def extract_fields(text: str) -> Optional[dict]:
+    """
+    Parsed fields in the same shape as the LLM parser's output, or None when
+    the document kind or any required field is uncertain.
+    """
+    if not RULES_ENABLED or not text or not text.strip():
+        return None
+    kind = document_kind(text)
+    if kind is None:
+        return None
+
+    fields = _generic_fields(text, kind)
+    template = _match_template(text, kind)
+    if template is not None:
+        fields.update(template.extract(text))
+
+    required = [f for f in FIELD_KEYS[kind] if f != "po_reference"]
+    # An invoice that mentions a PO must yield its reference, or reconciliation would miss it.
+    if kind == "invoice" and _MENTIONS_PO.search(text):
+        required.append("po_reference")
+    confidence = min((fields[f][1] if f in fields else 0.0) for f in required)
+    if confidence < MIN_CONFIDENCE:
+        return None
+
+    # Only this kind's keys are filled; the other kind's stay null, as in LLM output
+    parsed = dict.fromkeys(PARSED_KEYS)
+    for field, (value, _) in fields.items():
+        parsed[FIELD_KEYS[kind][field]] = value
+    return parsed
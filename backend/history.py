@@ -0,0 +1,144 @@
+# history.py  – reading the discrepancies table: keyset pages and streaming export
+#
+# Rows are ordered newest first by (timestamp, id), backed by the composite
+# index ix_discrepancies_timestamp_id. Pages continue from an opaque cursor
+# holding the last (timestamp, id) seen, so deep pages cost the same as the
+# first one. Exports iterate a server-side cursor in batches and never hold
+# more than one batch in memory.
+#
+# SQLite stores the server_default timestamp as text ('YYYY-MM-DD HH:MM:SS'),
+# and compares it as text. Cursors therefore carry the stored string as-is and
+# bounds are bound as strings; a Python datetime would be bound as
+# '... HH:MM:SS.000000' and sort after every row of the same second.
+import base64
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import DateTime, String, literal, select, tuple_, type_coerce
+
+from db import IS_SQLITE, read_engine
+from discrepancy_engine import vendor_key
+from models import Discrepancy, InvoiceData
+import vendors
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "timestamp", "invoice_id", "po_id", "vendor", "description", "summary_text")
+
+
+def encode_cursor(timestamp_key, row_id: int) -> str:
+    """timestamp_key is the stored timestamp as selected by _query (text on SQLite)."""
+    if isinstance(timestamp_key, datetime):
+        timestamp_key = timestamp_key.isoformat(sep=" ")
+    raw = json.dumps([timestamp_key, row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(timestamp_key, id) from encode_cursor(); ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp_key, row_id = json.loads(raw)
+        datetime.fromisoformat(timestamp_key)
+        return timestamp_key, int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _timestamp_param(value: str):
+    """A bound value comparable with the timestamp column in its stored form."""
+    if IS_SQLITE:
+        return literal(value, String)
+    return literal(datetime.fromisoformat(value), DateTime)
+
+
+def _query(vendor: Optional[str], date_from: Optional[date], date_to: Optional[date]):
+    query = (
+        select(
+            Discrepancy.id,
+            Discrepancy.timestamp,
+            # The stored value, unconverted, for cursors
+            type_coerce(Discrepancy.timestamp, String).label("timestamp_key"),
+            Discrepancy.invoice_id,
+            Discrepancy.po_id,
+            InvoiceData.vendor,
+            Discrepancy.description,
+            Discrepancy.details,
+        )
+        .outerjoin(InvoiceData, InvoiceData.id == Discrepancy.invoice_id)
+    )
+    if vendor:
+        # Resolved through the vendor alias table, like reconciliation; pick up
+        # aliases another process confirmed since this one loaded them
+        vendors.refresh()
+        query = query.where(InvoiceData.vendor_key == vendor_key(vendor))
+    # A bare date sorts before every timestamp of that day in both text formats
+    if date_from is not None:
+        query = query.where(Discrepancy.timestamp >= _timestamp_param(date_from.isoformat()))
+    if date_to is not None:
+        query = query.where(Discrepancy.timestamp < _timestamp_param((date_to + timedelta(days=1)).isoformat()))
+    return query.order_by(Discrepancy.timestamp.desc(), Discrepancy.id.desc())
+
+
+def _item(row) -> dict:
+    try:
+        details = json.loads(row.details or "{}")
+    except Exception:
+        details = {"summary_text": row.details}
+    if not isinstance(details, dict):
+        details = {"summary_text": str(details)}
+    return {
+        "id": row.id,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "invoice_id": row.invoice_id,
+        "po_id": row.po_id,
+        "vendor": row.vendor,
+        "description": row.description,
+        "summary_text": details.get("summary_text"),
+        "discrepancies": details.get("discrepancies"),
+    }
+
+
+def page(vendor: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None,
+         cursor: Optional[str] = None, limit: int = 100) -> dict:
+    """One page of history, newest first, plus the cursor for the next page (None at the end)."""
+    query = _query(vendor, date_from, date_to)
+    if cursor:
+        after_timestamp, after_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(Discrepancy.timestamp, Discrepancy.id) < tuple_(_timestamp_param(after_timestamp), after_id)
+        )
+    with read_engine.connect() as conn:
+        rows = conn.execute(query.limit(limit + 1)).all()
+    next_cursor = encode_cursor(rows[limit - 1].timestamp_key, rows[limit - 1].id) if len(rows) > limit else None
+    return {"items": [_item(row) for row in rows[:limit]], "next_cursor": next_cursor}
+
+
+def _csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def export(fmt: str, vendor: Optional[str] = None, date_from: Optional[date] = None,
+           date_to: Optional[date] = None) -> Iterator[str]:
+    """
+    Yield the filtered history as CSV (header first) or NDJSON, one batch of
+    EXPORT_BATCH_SIZE rows at a time from a server-side cursor.
+    """
+    if fmt == "csv":
+        yield _csv_line(EXPORT_COLUMNS)
+    with read_engine.connect() as conn:
+        result = conn.execution_options(yield_per=EXPORT_BATCH_SIZE).execute(_query(vendor, date_from, date_to))
+        for batch in result.partitions():
+            items = [_item(row) for row in batch]
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for item in items:
+                    writer.writerow([item[column] for column in EXPORT_COLUMNS])
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(item, default=str) + "\n" for item in items)
@@ -0,0 +1,264 @@
+# ingest.py  – storing parsed documents and running multi-file upload batches
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from typing import AsyncIterator, List, Optional
+
+from db import SessionLocal
+from models import InvoiceData, POData
+from parser_local import parse_document
+from field_extractor import document_kind
+from jobs import MAX_WORKERS, submit_task
+from metrics import stage_timer
+from reconcile import auto_reconcile
+import query_cache
+import vendors
+
+MODELS = {"invoice": InvoiceData, "po": POData}
+UPLOAD_DIRS = {"invoice": "uploads/invoices", "po": "uploads/pos", "auto": "uploads/batch"}
+
+# Parses in flight per batch; the shared parse pool bounds the total.
+BATCH_CONCURRENCY = int(os.getenv("VERIFIN_BATCH_CONCURRENCY", str(MAX_WORKERS)))
+# Upper bound on rows written per transaction.
+BATCH_COMMIT_SIZE = int(os.getenv("VERIFIN_BATCH_COMMIT_SIZE", "50"))
+MAX_BATCH_FILES = int(os.getenv("VERIFIN_MAX_BATCH_FILES", "1000"))
+# Refuse archives that would expand past this (zip bombs).
+MAX_ARCHIVE_BYTES = int(os.getenv("VERIFIN_MAX_ARCHIVE_MB", "2048")) * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+# ---------- Storage ----------
+def store_documents(documents: List[dict]) -> List[int]:
+    """
+    Insert parsed documents in a single transaction and return their ids,
+    then re-evaluate the invoice/PO pairs they affect (see reconcile.py).
+    Each document is {"kind", "filename", "parsed_data", "text", "source"}.
+    """
+    # New vendor spellings get resolved (or created) before vendor_key is computed
+    vendors.register(doc["parsed_data"].get("vendor") for doc in documents)
+    db = SessionLocal()
+    try:
+        rows = []
+        for doc in documents:
+            model = MODELS[doc["kind"]]
+            rows.append(model(
+                filename=doc["filename"],
+                raw_text=doc["text"],
+                parsed_data=json.dumps(doc["parsed_data"], default=str),
+                parse_source=doc["source"],
+                **model.fields_from_parsed(doc["parsed_data"])
+            ))
+        db.add_all(rows)
+        # flush assigns ids without the per-row refresh a post-commit read would trigger
+        db.flush()
+        ids = [row.id for row in rows]
+        with stage_timer("db_commit"):
+            db.commit()
+        with stage_timer("discrepancy_detection"):
+            auto_reconcile(
+                SessionLocal,
+                invoice_ids=[i for doc, i in zip(documents, ids) if doc["kind"] == "invoice"],
+                po_ids=[i for doc, i in zip(documents, ids) if doc["kind"] == "po"],
+            )
+        query_cache.bump_data_version()
+        return ids
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# ---------- Upload paths ----------
+def upload_path(dest_dir: str, filename: str) -> str:
+    """
+    A fresh path for one upload. Parsing runs later on the job pool, so
+    same-named uploads must not share a file; the random prefix keeps them apart.
+    """
+    name = os.path.basename(filename or "") or "upload"
+    return os.path.join(dest_dir, f"{uuid.uuid4().hex[:12]}_{name}")
+
+
+def batch_dir(kind: str) -> str:
+    """A directory of its own for one upload batch, so member names only have to be unique within it."""
+    return os.path.join(UPLOAD_DIRS[kind], uuid.uuid4().hex[:12])
+
+
+@contextmanager
+def new_file(file_path: str):
+    """
+    Open a fresh file for writing that appears at file_path only once it is
+    complete. Extraction mmaps stored uploads, and truncating a mapped file
+    kills the reader with SIGBUS, so existing files are never reopened for
+    writing: the data goes to an exclusive temp file that os.replace() moves
+    into place.
+    """
+    tmp_path = f"{file_path}.part"
+    f = open(tmp_path, "xb")
+    try:
+        with f:
+            yield f
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# ---------- Archives ----------
+def _unique_path(dest_dir: str, name: str, taken: set) -> str:
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        n += 1
+        candidate = f"{base}-{n}{ext}"
+    taken.add(candidate)
+    return os.path.join(dest_dir, candidate)
+
+
+def is_zip(file_path: str) -> bool:
+    with open(file_path, "rb") as f:
+        return f.read(4) == ZIP_MAGIC
+
+
+def expand_zip(zip_path: str, dest_dir: str, taken: set) -> List[tuple]:
+    """
+    Stream every file in the archive to dest_dir, hashing it on the way.
+    Directory structure is flattened (which also rules out path traversal);
+    hidden and macOS resource-fork entries are skipped.
+    Returns [(file_path, filename, sha256)].
+    """
+    extracted = []
+    with zipfile.ZipFile(zip_path) as archive:
+        members = [
+            m for m in archive.infolist()
+            if not m.is_dir()
+            and not m.filename.startswith("__MACOSX/")
+            and not os.path.basename(m.filename).startswith(".")
+        ]
+        if sum(m.file_size for m in members) > MAX_ARCHIVE_BYTES:
+            raise ValueError("Archive expands past VERIFIN_MAX_ARCHIVE_MB")
+        for member in members:
+            name = os.path.basename(member.filename)
+            file_path = _unique_path(dest_dir, name, taken)
+            digest = hashlib.sha256()
+            with archive.open(member) as src, new_file(file_path) as dst:
+                for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            extracted.append((file_path, name, digest.hexdigest()))
+    return extracted
+
+
+# ---------- Batch pipeline ----------
+def _resolve_kind(kind: str, parsed: dict, text: str) -> Optional[str]:
+    if kind != "auto":
+        return kind
+    detected = document_kind(text or "")
+    if detected:
+        return detected
+    if parsed.get("invoice_number"):
+        return "invoice"
+    if parsed.get("purchase_order_id"):
+        return "po"
+    return None
+
+
+def _parse_one(file_path: str, filename: str, content_hash: str, kind: str) -> dict:
+    """Runs on the parse pool; returns a document ready for store_documents() or an error."""
+    parsed, text, source = parse_document(file_path, content_hash=content_hash)
+    if "error" in parsed:
+        return {"filename": filename, "error": parsed["error"]}
+    resolved = _resolve_kind(kind, parsed, text)
+    if resolved is None:
+        return {"filename": filename, "error": "Could not tell whether this is an invoice or a PO"}
+    return {"kind": resolved, "filename": filename, "parsed_data": parsed, "text": text, "source": source}
+
+
+def _result_event(doc: dict, record_id: Optional[int] = None, error: Optional[str] = None) -> dict:
+    event = {"event": "result", "filename": doc["filename"]}
+    if error or "error" in doc:
+        event.update(status="failed", error=error or doc["error"])
+    else:
+        event.update(status="done", kind=doc["kind"], record_id=record_id,
+                     source=doc["source"], parsed_data=doc["parsed_data"])
+    return event
+
+
+async def run_batch(files: List[tuple], kind: str) -> AsyncIterator[dict]:
+    """
+    Parse files ([(file_path, filename, sha256)]) with at most BATCH_CONCURRENCY
+    in flight and yield one event per file as it finishes, then a summary.
+
+    Finished documents are group-committed: whatever is ready when the
+    previous commit returns goes into the next transaction (up to
+    BATCH_COMMIT_SIZE rows), so a fast stream batches while a slow one still
+    reports each file promptly.
+    """
+    started = time.perf_counter()
+    pending = list(reversed(files))
+    in_flight = {}  # task -> filename
+    done, failed = 0, 0
+
+    def _fill() -> None:
+        while pending and len(in_flight) < BATCH_CONCURRENCY:
+            file_path, filename, content_hash = pending.pop()
+            future = submit_task(_parse_one, file_path, filename, content_hash, kind)
+            in_flight[asyncio.wrap_future(future)] = filename
+
+    try:
+        _fill()
+        while in_flight:
+            finished, _ = await asyncio.wait(set(in_flight), return_when=asyncio.FIRST_COMPLETED)
+            ready = []
+            for task in finished:
+                filename = in_flight.pop(task)
+                try:
+                    ready.append(task.result())
+                except Exception as e:
+                    ready.append({"filename": filename, "error": str(e)})
+            _fill()
+
+            parsed = [doc for doc in ready if "error" not in doc]
+            for doc in ready:
+                if "error" in doc:
+                    failed += 1
+                    yield _result_event(doc)
+            for start in range(0, len(parsed), BATCH_COMMIT_SIZE):
+                chunk = parsed[start:start + BATCH_COMMIT_SIZE]
+                try:
+                    ids = await asyncio.to_thread(store_documents, chunk)
+                except Exception as e:
+                    failed += len(chunk)
+                    for doc in chunk:
+                        yield _result_event(doc, error=f"Could not store: {e}")
+                    continue
+                done += len(chunk)
+                for doc, record_id in zip(chunk, ids):
+                    yield _result_event(doc, record_id)
+    finally:
+        # Client went away: don't start the rest of the batch.
+        for task in in_flight:
+            task.cancel()
+
+    yield {
+        "event": "summary",
+        "total": len(files),
+        "done": done,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def format_event(event: dict, fmt: str) -> str:
+    """One NDJSON line, or one Server-Sent Events message."""
+    payload = json.dumps(event, default=str)
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {payload}\n\n"
+    return payload + "\n"
@@ -0,0 +1,89 @@
+# jobs.py  – bounded background job queue for the upload → parse pipeline
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+# Parsing is dominated by pdfplumber/Tesseract and the blocking LLM call, so a
+# small thread pool keeps that work off the event loop without oversubscribing.
+MAX_WORKERS = int(os.getenv("VERIFIN_PARSE_WORKERS", "4"))
+# Finished jobs are kept so clients can poll them; the oldest are dropped first.
+MAX_FINISHED_JOBS = int(os.getenv("VERIFIN_MAX_FINISHED_JOBS", "1000"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="verifin-parse")
+_jobs = {}
+_finished_order = []
+_lock = threading.Lock()
+
+
+def _new_job(kind: str, filename: str) -> dict:
+    return {
+        "job_id": uuid.uuid4().hex,
+        "kind": kind,
+        "filename": filename,
+        "status": "queued",
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+def _update(job_id: str, **fields) -> None:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+def _finish(job_id: str, **fields) -> None:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields, finished_at=time.time())
+        _finished_order.append(job_id)
+        while len(_finished_order) > MAX_FINISHED_JOBS:
+            _jobs.pop(_finished_order.pop(0), None)
+
+
+def _run(job_id: str, fn: Callable, args: tuple) -> None:
+    _update(job_id, status="running", started_at=time.time())
+    try:
+        result = fn(*args)
+    except Exception as e:
+        print(f"[JOB ERROR] {job_id}: {e}")
+        _finish(job_id, status="failed", error=str(e))
+        return
+    _finish(job_id, status="done", result=result)
+
+
+def submit_job(kind: str, filename: str, fn: Callable, *args) -> dict:
+    """
+    Queue fn(*args) on the parse worker pool and return a snapshot of the job.
+    The job's "result" is whatever fn returns; exceptions mark it "failed".
+    """
+    job = _new_job(kind, filename)
+    with _lock:
+        _jobs[job["job_id"]] = job
+        snapshot = dict(job)
+    _executor.submit(_run, job["job_id"], fn, args)
+    return snapshot
+
+
+def submit_task(fn: Callable, *args) -> Future:
+    """
+    Run fn(*args) on the parse worker pool without a job record, for callers
+    that track their own results (e.g. batch uploads).
+    """
+    return _executor.submit(fn, *args)
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Return a copy of the job record, or None if it is unknown or expired."""
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job is not None else None
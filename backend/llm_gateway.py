@@ -0,0 +1,275 @@
+# llm_gateway.py  – single shared client for all Shivaay LLM calls
+#
+# Every caller goes through one AsyncOpenAI client running on a dedicated
+# event-loop thread, so HTTP connections are pooled and the limits below apply
+# process-wide. Sync code (parse jobs, sync endpoints) uses chat(); async code
+# can await achat(). openai/httpx are imported when the gateway starts, not
+# when this module is imported.
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import components  # noqa: F401  (loads .env)
+from metrics import LLM_REQUEST_SECONDS, LLM_REQUESTS, LLM_TOKENS
+
+DEFAULT_BASE_URL = "https://api.futurixai.com/api/shivaay/v1"
+
+
+def retryable_errors() -> tuple:
+    """Errors worth retrying: throttling, timeouts, dropped connections and 5xx."""
+    import openai
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        requests_per_second: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+    ):
+        self.api_key = api_key or os.getenv("SHIVAAY_API_KEY") or "missing"
+        self.base_url = base_url or os.getenv("SHIVAAY_BASE_URL", DEFAULT_BASE_URL)
+        self.model = model or os.getenv("SHIVAAY_MODEL", "shivaay")
+        self.max_concurrency = max_concurrency or int(os.getenv("SHIVAAY_MAX_CONCURRENCY", "8"))
+        self.requests_per_second = (
+            requests_per_second if requests_per_second is not None else _env_float("SHIVAAY_RPS", 0)
+        )
+        self.timeout = timeout or _env_float("SHIVAAY_TIMEOUT", 60)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("SHIVAAY_MAX_RETRIES", "3"))
+        self.backoff_base = _env_float("SHIVAAY_BACKOFF_BASE", 0.5)
+        self.backoff_max = _env_float("SHIVAAY_BACKOFF_MAX", 20)
+
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._semaphore = None
+        self._bucket = None
+        self._retryable = ()
+        self._inflight = {}
+        self._start_lock = threading.Lock()
+        self.stats = {"requests": 0, "coalesced": 0, "retries": 0, "failures": 0}
+
+    # ---------- event loop ----------
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="verifin-llm-gateway", daemon=True
+                )
+                self._thread.start()
+                asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+        return self._loop
+
+    def start(self) -> None:
+        """Start the event loop and HTTP client now instead of on the first request."""
+        self._ensure_started()
+
+    async def _setup(self) -> None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        self._retryable = retryable_errors()
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            timeout=httpx.Timeout(self.timeout),
+        )
+        self._client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client,
+            timeout=self.timeout,
+            max_retries=0,  # retries are handled here, with jitter
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        burst = _env_float("SHIVAAY_RPS_BURST", max(self.requests_per_second, 1))
+        self._bucket = TokenBucket(self.requests_per_second, burst)
+
+    def close(self) -> None:
+        with self._start_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = self._thread = self._client = None
+
+    # ---------- requests ----------
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # "Full jitter" exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _request(self, params: dict) -> str:
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                started = time.perf_counter()
+                try:
+                    completion = await self._client.chat.completions.create(**params)
+                except self._retryable as e:
+                    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome="retryable_error")
+                    if attempt >= self.max_retries:
+                        self.stats["failures"] += 1
+                        LLM_REQUESTS.inc(outcome="failed")
+                        raise
+                    delay = self._backoff(attempt, e)
+                    error_name = type(e).__name__
+                except Exception:
+                    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome="error")
+                    self.stats["failures"] += 1
+                    LLM_REQUESTS.inc(outcome="failed")
+                    raise
+                else:
+                    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+                    LLM_REQUESTS.inc(outcome="ok")
+                    usage = getattr(completion, "usage", None)
+                    if usage is not None:
+                        LLM_TOKENS.inc(usage.prompt_tokens or 0, kind="prompt")
+                        LLM_TOKENS.inc(usage.completion_tokens or 0, kind="completion")
+                    return (completion.choices[0].message.content or "").strip()
+            attempt += 1
+            self.stats["retries"] += 1
+            LLM_REQUESTS.inc(outcome="retried")
+            print(f"[LLM] {error_name}, retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def _coalesced(self, params: dict) -> str:
+        # Identical in-flight requests share one upstream call
+        key = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            LLM_REQUESTS.inc(outcome="coalesced")
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(self._request(params))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _params(self, messages, temperature, max_tokens, model) -> dict:
+        return {
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+
+    async def achat(self, messages: list, temperature: float = 0.0, max_tokens: int = 512, model: Optional[str] = None) -> str:
+        """Awaitable chat completion; returns the stripped message content."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(
+            self._coalesced(self._params(messages, temperature, max_tokens, model)), loop
+        )
+        return await asyncio.wrap_future(future)
+
+    def chat(self, messages: list, temperature: float = 0.0, max_tokens: int = 512, model: Optional[str] = None) -> str:
+        """Blocking chat completion for sync callers; returns the stripped message content."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(
+            self._coalesced(self._params(messages, temperature, max_tokens, model)), loop
+        )
+        return future.result()
+
+    def chat_many(self, requests: list, temperature: float = 0.0, max_tokens: int = 512,
+                  model: Optional[str] = None) -> list:
+        """
+        Blocking: run several chat completions (a list of message lists)
+        concurrently under the usual limits. Returns each content, or the
+        exception it raised, in request order.
+        """
+        loop = self._ensure_started()
+        futures = [
+            asyncio.run_coroutine_threadsafe(
+                self._coalesced(self._params(messages, temperature, max_tokens, model)), loop
+            )
+            for messages in requests
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Process-wide gateway, configured from the SHIVAAY_* environment variables."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+def chat(messages: list, temperature: float = 0.0, max_tokens: int = 512, model: Optional[str] = None) -> str:
+    return get_gateway().chat(messages, temperature=temperature, max_tokens=max_tokens, model=model)
+
+
+def chat_many(requests: list, temperature: float = 0.0, max_tokens: int = 512, model: Optional[str] = None) -> list:
+    return get_gateway().chat_many(requests, temperature=temperature, max_tokens=max_tokens, model=model)
+
+
+async def achat(messages: list, temperature: float = 0.0, max_tokens: int = 512, model: Optional[str] = None) -> str:
+    return await get_gateway().achat(messages, temperature=temperature, max_tokens=max_tokens, model=model)
@@ -1,32 +1,47 @@
 # main.py
 import os
 import json
-from fastapi import FastAPI, UploadFile, File, Query
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List
+from fastapi import FastAPI, UploadFile, File, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from dotenv import load_dotenv
-from openai import OpenAI
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from parser_local import parse_with_shivaay_ai
-from discrepancy_engine import detect_discrepancies
-from db import init_db, SessionLocal
-from models import InvoiceData, POData, Discrepancy
+import components
+from parser_local import parse_document
+from db import SessionLocal
+from models import InvoiceData, POData, Discrepancy, ReconciliationStatus
 from discrepancy_llm import run_discrepancy_query
-
-# ====== Load environment & Initialize DB ======
-load_dotenv()
-init_db()
-
-# ====== Initialize LLM Client ======
-client = OpenAI(
-    api_key=os.getenv("SHIVAAY_API_KEY"),
-    base_url=os.getenv("SHIVAAY_BASE_URL", "https://api.futurixai.com/api/shivaay/v1")
-)
+from jobs import submit_job, get_job
+import ingest
+import parse_cache
+import llm_gateway
+from reconcile import evaluate_pair, reconcile_batch, reconcile_invoices
+import query_cache
+import summaries
+import history
+import vendors
+import metrics
+import profiler
+from metrics import stage_timer
+
+# ====== Startup ======
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema, backfills and the vendor index must be in place before serving;
+    # the OCR and LLM stacks load in the background (or on first use).
+    await asyncio.to_thread(components.get, "database")
+    components.prewarm()
+    yield
+    components.shutdown()
 
 # ====== Initialize FastAPI App ======
-app = FastAPI(title="Verifin Discrepancy Checker")
+app = FastAPI(title="Verifin Discrepancy Checker", lifespan=lifespan)
 
 # ====== CORS ======
 app.add_middleware(
@@ -40,6 +55,12 @@ app.add_middleware(
 # ====== Serve static frontend files (optional) ======
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.get("/health")
+def health():
+    """Ready once the database is initialized; also reports which components are loaded."""
+    return {"ready": components.is_ready("database"), "components": components.status()}
+
+
 @app.get("/")
 def serve_home():
     file_path = "static/index.html"
@@ -48,33 +69,51 @@ def serve_home():
     return {"message": "Verifin API root. Use the endpoints to upload files."}
 
 
+# ====== Streamed upload ingestion ======
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def _save_upload(file: UploadFile, dest_dir: str):
+    """
+    Stream the upload to its own path under dest_dir in fixed-size chunks,
+    hashing it in the same pass, so only one chunk is ever held in memory.
+    Returns (path, sha256).
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    file_path = ingest.upload_path(dest_dir, file.filename)
+    digest = hashlib.sha256()
+    with stage_timer("file_write"), ingest.new_file(file_path) as f:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return file_path, digest.hexdigest()
+
+
+# ====== Parse + store (runs on the background job pool) ======
+def _parse_and_store(model, file_path: str, filename: str, content_hash: str = None) -> dict:
+    parsed_data, extracted_text, source = parse_document(file_path, content_hash=content_hash)
+    kind = "invoice" if model is InvoiceData else "po"
+    [record_id] = ingest.store_documents([{
+        "kind": kind,
+        "filename": filename,
+        "parsed_data": parsed_data,
+        "text": extracted_text,
+        "source": source,
+    }])
+    return {"id": record_id, "parsed_data": parsed_data}
+
+
 # ====== Upload Invoice ======
 @app.post("/upload-invoice")
 async def upload_invoice(file: UploadFile = File(...)):
     try:
-        os.makedirs("uploads/invoices", exist_ok=True)
-        file_path = f"uploads/invoices/{file.filename}"
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-
-        parsed_data = parse_with_shivaay_ai(file_path)
-        parsed_json_text = json.dumps(parsed_data, default=str)
-
-        db = SessionLocal()
-        try:
-            inv = InvoiceData(
-                filename=file.filename,
-                raw_text="",
-                parsed_data=parsed_json_text
-            )
-            db.add(inv)
-            db.commit()
-            db.refresh(inv)
-        finally:
-            db.close()
+        file_path, content_hash = await _save_upload(file, "uploads/invoices")
 
-        return {"message": "Invoice uploaded, parsed, and saved", "parsed_data": parsed_data}
+        job = submit_job("invoice", file.filename, _parse_and_store, InvoiceData, file_path, file.filename, content_hash)
+        return {"message": "Invoice uploaded and queued for parsing", "job_id": job["job_id"], "status": job["status"]}
     except Exception as e:
         return {"error": f"Error while processing invoice: {str(e)}"}
 
@@ -83,33 +122,97 @@ async def upload_invoice(file: UploadFile = File(...)):
 @app.post("/upload-po")
 async def upload_po(file: UploadFile = File(...)):
     try:
-        os.makedirs("uploads/pos", exist_ok=True)
-        file_path = f"uploads/pos/{file.filename}"
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-
-        parsed_data = parse_with_shivaay_ai(file_path)
-        parsed_json_text = json.dumps(parsed_data, default=str)
-
-        db = SessionLocal()
-        try:
-            po = POData(
-                filename=file.filename,
-                raw_text="",
-                parsed_data=parsed_json_text
-            )
-            db.add(po)
-            db.commit()
-            db.refresh(po)
-        finally:
-            db.close()
+        file_path, content_hash = await _save_upload(file, "uploads/pos")
 
-        return {"message": "PO uploaded, parsed, and saved", "parsed_data": parsed_data}
+        job = submit_job("po", file.filename, _parse_and_store, POData, file_path, file.filename, content_hash)
+        return {"message": "PO uploaded and queued for parsing", "job_id": job["job_id"], "status": job["status"]}
     except Exception as e:
         return {"error": f"Error while processing PO: {str(e)}"}
 
 
+# ====== Batch Upload ======
+@app.post("/upload-batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    kind: str = Query("auto", pattern="^(invoice|po|auto)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+):
+    """
+    Upload many documents (and/or ZIP archives of them) in one request. Files
+    are parsed with bounded concurrency and one result per file is streamed
+    back as it finishes (NDJSON lines or SSE "result" events), followed by a
+    "summary". kind=auto decides invoice vs PO per document.
+    """
+    dest_dir = ingest.batch_dir(kind)
+    os.makedirs(dest_dir, exist_ok=True)
+    queued, taken = [], set()
+    try:
+        for file in files:
+            file_path, content_hash = await _save_upload(file, dest_dir)
+            if ingest.is_zip(file_path):
+                queued.extend(await asyncio.to_thread(ingest.expand_zip, file_path, dest_dir, taken))
+                os.remove(file_path)
+            else:
+                taken.add(file.filename)
+                queued.append((file_path, file.filename, content_hash))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error while reading upload: {e}")
+    if len(queued) > ingest.MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {ingest.MAX_BATCH_FILES} files per batch")
+
+    async def _events():
+        async for event in ingest.run_batch(queued, kind):
+            yield ingest.format_event(event, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(_events(), media_type=media_type)
+
+
+# ====== Parse Job Status ======
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    Poll a queued upload. Once status is "done", "parsed_data" holds the parsed
+    document exactly as the upload endpoints used to return it.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    result = job.pop("result") or {}
+    job["parsed_data"] = result.get("parsed_data")
+    job["record_id"] = result.get("id")
+    return job
+
+
+# ====== Parse Cache Stats ======
+@app.get("/parse-cache/stats")
+def parse_cache_stats():
+    """Hit/miss counters and current size of the content-addressed parse cache."""
+    return parse_cache.stats()
+
+
+# ====== Metrics & Profiling ======
+@app.get("/metrics")
+def metrics_endpoint():
+    """Per-stage latency histograms and pipeline counters in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+def debug_profile(seconds: float = Query(5.0, gt=0, le=profiler.MAX_PROFILE_SECONDS)):
+    """
+    Sample every thread for `seconds` and return collapsed stacks (feed to
+    flamegraph.pl or speedscope). Disabled unless VERIFIN_ENABLE_PROFILER=1.
+    """
+    if not profiler.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    try:
+        return PlainTextResponse(profiler.sample(seconds))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 # ====== Detect Discrepancy (Natural Language Summary Only) ======
 from fastapi.responses import PlainTextResponse
 
@@ -117,7 +220,9 @@ from fastapi.responses import PlainTextResponse
 def detect_discrepancy():
     """
     Compare the latest uploaded Invoice and PO data saved in DB.
-    Return ONLY plain natural-language text (no JSON brackets).
+    Return ONLY plain natural-language text (no JSON brackets): the cached
+    LLM summary for this mismatch pattern if there is one, otherwise a
+    templated summary while the LLM version is generated in the background.
     """
     db = SessionLocal()
     try:
@@ -126,63 +231,197 @@ def detect_discrepancy():
         if not latest_invoice or not latest_po:
             return PlainTextResponse("No invoice or PO found in the database. Please upload both first.")
 
-        invoice_parsed = json.loads(latest_invoice.parsed_data or "{}")
-        po_parsed = json.loads(latest_po.parsed_data or "{}")
+        with stage_timer("discrepancy_detection"):
+            status, changed = evaluate_pair(db, latest_invoice, latest_po)
+        discrepancies = json.loads(status.discrepancies or "{}")
+
+        # ---------- Summary: templated now, LLM-polished once cached ----------
+        with stage_timer("summary"):
+            final_summary, _ = summaries.summarize(discrepancies)
+
+        # ---------- Store summary (only when it changed) ----------
+        summary_version = f"{status.invoice_version}{status.po_version}"
+        if status.summary_version != summary_version:
+            db.add(Discrepancy(
+                description=f"Invoice {latest_invoice.filename} vs PO {latest_po.filename}",
+                invoice_id=latest_invoice.id,
+                po_id=latest_po.id,
+                details=json.dumps({
+                    "invoice_id": latest_invoice.id,
+                    "po_id": latest_po.id,
+                    "summary_text": final_summary
+                }, indent=2)
+            ))
+            changed = True
+        elif status.summary_text != final_summary:
+            # Same comparison, polished wording: rewrite its history row rather than log it twice
+            record = (
+                db.query(Discrepancy)
+                .filter(Discrepancy.invoice_id == latest_invoice.id, Discrepancy.po_id == latest_po.id)
+                .order_by(Discrepancy.id.desc())
+                .first()
+            )
+            if record is not None:
+                try:
+                    record_details = json.loads(record.details or "{}")
+                except ValueError:
+                    record_details = {}
+                record_details["summary_text"] = final_summary
+                record.details = json.dumps(record_details, indent=2, default=str)
+            changed = True
+        status.summary_text = final_summary
+        status.summary_version = summary_version
+        if changed:
+            with stage_timer("db_commit"):
+                db.commit()
+            query_cache.bump_data_version()
 
-        discrepancies = detect_discrepancies(invoice_parsed, po_parsed) or {}
+        # ✅ Return plain text directly (no JSON brackets)
+        return PlainTextResponse(final_summary)
 
-        # ---------- Generate summary ----------
-        if not discrepancies:
-            final_summary = "Invoice and Purchase Order match perfectly. No discrepancies found."
-        else:
-            prompt = (
-                "You are a finance assistant. Summarize these discrepancies between an invoice "
-                "and a purchase order in clear, natural English. Mention which fields differ and their values. "
-                "Keep it concise and professional.\n\n"
-                f"Invoice file: {latest_invoice.filename}\n"
-                f"PO file: {latest_po.filename}\n\n"
-                f"Discrepancies:\n{json.dumps(discrepancies, indent=2)}"
-            )
+    finally:
+        db.close()
 
-            try:
-                completion = client.chat.completions.create(
-                    model=os.getenv("SHIVAAY_MODEL", "shivaay"),
-                    messages=[
-                        {"role": "system", "content": "You are a helpful finance assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=300
-                )
-                final_summary = completion.choices[0].message.content.strip()
-            except Exception as e:
-                # fallback summary
-                mismatch_lines = [
-                    f"- {f}: Invoice = {v.get('invoice')}, PO = {v.get('po')}"
-                    for f, v in discrepancies.items()
-                ]
-                final_summary = (
-                    f"Invoice and PO do not match. Fields with discrepancies:\n" +
-                    "\n".join(mismatch_lines)
-                )
+# ====== Batch Reconciliation ======
+@app.post("/reconcile-batch")
+def reconcile_batch_endpoint(include_matched: bool = Query(False)):
+    """
+    Match every invoice without a reconciliation status against its
+    candidate POs (by normalized purchase_order_id, falling back to vendor)
+    and store one discrepancy record per newly evaluated pair. With
+    include_matched, pairs whose documents are unchanged are reported from
+    reconciliation_status instead of being recompared. No LLM calls are made.
+    """
+    db = SessionLocal()
+    try:
+        with stage_timer("discrepancy_detection"):
+            result = reconcile_batch(db, include_matched=include_matched)
+        query_cache.bump_data_version()
+        return result
+    except Exception as e:
+        db.rollback()
+        return {"error": f"Error while reconciling batch: {str(e)}"}
+    finally:
+        db.close()
+
+
+@app.get("/reconciliation-status")
+def reconciliation_status(
+    invoice_id: int = Query(None),
+    po_id: int = Query(None),
+    only_discrepancies: bool = Query(False),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Current comparison result per invoice/PO pair, as kept by incremental reconciliation."""
+    db = SessionLocal()
+    try:
+        query = db.query(ReconciliationStatus)
+        if invoice_id is not None:
+            query = query.filter(ReconciliationStatus.invoice_id == invoice_id)
+        if po_id is not None:
+            query = query.filter(ReconciliationStatus.po_id == po_id)
+        if only_discrepancies:
+            query = query.filter(ReconciliationStatus.has_discrepancies.is_(True))
+        total = query.count()
+        rows = query.order_by(ReconciliationStatus.id).offset(offset).limit(limit).all()
+        return {
+            "total": total,
+            "items": [
+                {
+                    "invoice_id": row.invoice_id,
+                    "po_id": row.po_id,
+                    "matched_on": row.matched_on,
+                    "has_discrepancies": bool(row.has_discrepancies),
+                    "fields": json.loads(row.discrepancy_fields or "[]"),
+                    "summary_text": row.summary_text,
+                    "evaluated_at": row.evaluated_at,
+                }
+                for row in rows
+            ],
+        }
+    finally:
+        db.close()
 
-        # ---------- Store summary ----------
-        discrepancy_record = Discrepancy(
-            description=f"Invoice {latest_invoice.filename} vs PO {latest_po.filename}",
-            details=json.dumps({
-                "invoice_id": latest_invoice.id,
-                "po_id": latest_po.id,
-                "summary_text": final_summary
-            }, indent=2)
-        )
-        db.add(discrepancy_record)
-        db.commit()
 
-        # ✅ Return plain text directly (no JSON brackets)
-        return PlainTextResponse(final_summary)
 
+# ====== Discrepancy History ======
+@app.get("/discrepancies")
+def list_discrepancies(
+    vendor: str = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    cursor: str = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Stored discrepancy records, newest first. Pass the returned next_cursor
+    to get the following page; vendor matches through the alias table and
+    the date range is inclusive.
+    """
+    try:
+        return history.page(vendor, date_from, date_to, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/discrepancies/export")
+def export_discrepancies(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    vendor: str = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+):
+    """Stream the filtered discrepancy history as CSV or NDJSON, batch by batch."""
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="discrepancies.{format}"'}
+    return StreamingResponse(history.export(format, vendor, date_from, date_to), media_type=media_type, headers=headers)
+
+
+# ====== Vendors ======
+@app.get("/vendors/match")
+def vendor_match(name: str = Query(...), limit: int = Query(5, ge=1, le=50)):
+    """
+    Vendors a name resolves to or resembles (trigram similarity at or above
+    VERIFIN_VENDOR_SIMILARITY), with the ids of their purchase orders.
+    """
+    result = vendors.match(name, limit=limit)
+    keys = [c["vendor_key"] for c in result["candidates"]]
+    if result["vendor_key"]:
+        keys.insert(0, result["vendor_key"])
+    db = SessionLocal()
+    try:
+        result["po_ids"] = [
+            row.id for row in
+            db.query(POData.id).filter(POData.vendor_key.in_(keys)).order_by(POData.id.desc()).limit(100)
+        ] if keys else []
     finally:
         db.close()
+    return result
+
+
+@app.get("/vendors/suggestions")
+def vendor_suggestions(limit: int = Query(100, ge=1, le=1000)):
+    """Vendor spellings that look like a known vendor; confirm one with POST /vendors/aliases."""
+    return {"suggestions": vendors.suggestions(limit=limit)}
+
+
+@app.post("/vendors/aliases")
+def add_vendor_alias(alias: str = Query(...), vendor: str = Query(...)):
+    """Treat `alias` as the same vendor as `vendor` from now on, and re-reconcile affected invoices."""
+    try:
+        result = vendors.add_alias(alias, vendor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db = SessionLocal()
+    try:
+        with stage_timer("discrepancy_detection"):
+            reconciled = reconcile_invoices(db, result.pop("invoice_ids"), force=True)
+        query_cache.bump_data_version()
+    finally:
+        db.close()
+    result["pairs_evaluated"] = reconciled["pairs_evaluated"]
+    return result
 
 # ====== Run LLM-generated SQL Discrepancy Check ======
 @app.post("/run-discrepancy-sql")
@@ -200,25 +439,27 @@ def run_discrepancy_sql(request: str = Query(...)):
         else:
             # fallback: stringify response for LLM summarization
             summary_input = json.dumps(resp, indent=2)
-            prompt = (
-                "You are a finance auditor. Summarize the following database discrepancy result "
-                "in clear, human-readable English for a business user. Be concise.\n\n"
-                f"{summary_input}"
-            )
-
-            try:
-                completion = client.chat.completions.create(
-                    model=os.getenv("SHIVAAY_MODEL", "shivaay"),
-                    messages=[
-                        {"role": "system", "content": "You are a helpful finance assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=250
+            summary_key = hashlib.sha256(summary_input.encode("utf-8")).hexdigest()
+            summary_text = query_cache.summary_cache.get(summary_key)
+            if summary_text is None:
+                prompt = (
+                    "You are a finance auditor. Summarize the following database discrepancy result "
+                    "in clear, human-readable English for a business user. Be concise.\n\n"
+                    f"{summary_input}"
                 )
-                summary_text = completion.choices[0].message.content.strip()
-            except Exception as e:
-                summary_text = f"Error summarizing results: {e}"
+
+                try:
+                    summary_text = llm_gateway.chat(
+                        [
+                            {"role": "system", "content": "You are a helpful finance assistant."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.3,
+                        max_tokens=250
+                    )
+                    query_cache.summary_cache.put(summary_key, summary_text)
+                except Exception as e:
+                    summary_text = f"Error summarizing results: {e}"
 
         # ✅ Return only clean summary
         return {"summary": summary_text}
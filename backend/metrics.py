@@ -0,0 +1,131 @@
+# metrics.py  – in-process counters/histograms rendered in Prometheus text format
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _label_key(labelnames, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Pipeline metrics ----------
+STAGE_SECONDS = Histogram(
+    "verifin_stage_duration_seconds",
+    "Time spent in each upload/parse/reconcile stage.",
+    ["stage"],
+)
+EXTRACTION_DOCUMENTS = Counter(
+    "verifin_extraction_documents_total",
+    "Documents extracted, by detected format and PDF text-layer backend.",
+    ["format", "backend"],
+)
+OCR_PAGES = Counter("verifin_ocr_pages_total", "PDF pages and images processed, by extraction method.", ["method"])
+LLM_REQUEST_SECONDS = Histogram(
+    "verifin_llm_request_duration_seconds",
+    "Latency of individual upstream LLM requests (each retry is one request).",
+    ["outcome"],
+)
+LLM_REQUESTS = Counter("verifin_llm_requests_total", "LLM gateway calls by outcome.", ["outcome"])
+LLM_TOKENS = Counter("verifin_llm_tokens_total", "Tokens reported by the LLM provider.", ["kind"])
+PARSE_PATHS = Counter("verifin_parse_path_total", "Parsed documents by path (cache, rules, llm, llm_chunked).", ["path"])
+PARSE_CACHE_LOOKUPS = Counter("verifin_parse_cache_lookups_total", "Parse cache lookups by result.", ["result"])
+SQL_GUARDRAIL_EVENTS = Counter(
+    "verifin_sql_guardrail_total",
+    "LLM-generated queries rejected by the plan check, stopped by the time budget or cut at the row cap.",
+    ["reason"],
+)
+SUMMARY_LOOKUPS = Counter(
+    "verifin_summary_lookups_total",
+    "Discrepancy summaries served, by source (llm = cached polished text, template = rendered locally).",
+    ["source"],
+)
+
+
+def stage_timer(stage: str):
+    """Context manager recording the duration of one pipeline stage."""
+    return STAGE_SECONDS.time(stage=stage)
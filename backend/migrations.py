@@ -0,0 +1,82 @@
+# migrations.py  – data backfills run at startup after init_db()
+import json
+
+from sqlalchemy import or_, select
+
+from db import SessionLocal
+from models import InvoiceData, POData, ReconciliationStatus, PARSED_FIELDS_VERSION
+import vendors
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _load(value) -> dict:
+    try:
+        return json.loads(value or "{}")
+    except Exception:
+        return {}
+
+
+def backfill_parsed_fields(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Fill the promoted columns (reference, vendor, total, date) of rows written
+    before they existed, or by an older PARSED_FIELDS_VERSION, in batches.
+    Returns the number of rows updated.
+    """
+    updated = 0
+    for model in (InvoiceData, POData):
+        db = SessionLocal()
+        try:
+            while True:
+                rows = (
+                    db.query(model.id, model.parsed_data)
+                    .filter(or_(model.fields_version.is_(None), model.fields_version < PARSED_FIELDS_VERSION))
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                parsed_rows = [(row_id, _load(parsed_data)) for row_id, parsed_data in rows]
+                vendors.register(
+                    parsed.get("vendor") for _, parsed in parsed_rows if isinstance(parsed, dict)
+                )
+                db.bulk_update_mappings(model, [
+                    {"id": row_id, **model.fields_from_parsed(parsed)}
+                    for row_id, parsed in parsed_rows
+                ])
+                db.commit()
+                updated += len(rows)
+        finally:
+            db.close()
+    if updated:
+        print(f"[DB] Backfilled parsed fields for {updated} rows")
+        prune_vendor_pairs()
+    return updated
+
+
+def prune_vendor_pairs() -> int:
+    """
+    Drop vendor-fallback pairs whose documents no longer share a vendor key
+    (e.g. after re-keying away from an unconfirmed fuzzy alias); the next
+    reconcile-batch re-matches those invoices. Returns the number removed.
+    """
+    db = SessionLocal()
+    try:
+        stale = (
+            select(ReconciliationStatus.id)
+            .join(InvoiceData, InvoiceData.id == ReconciliationStatus.invoice_id)
+            .join(POData, POData.id == ReconciliationStatus.po_id)
+            .where(
+                ReconciliationStatus.matched_on == "vendor",
+                or_(InvoiceData.vendor_key.is_(None), InvoiceData.vendor_key != POData.vendor_key),
+            )
+        )
+        removed = db.query(ReconciliationStatus).filter(ReconciliationStatus.id.in_(stale)).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+    if removed:
+        print(f"[DB] Removed {removed} vendor pairs that no longer share a vendor")
+    return removed
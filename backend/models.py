@@ -1,5 +1,33 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, func
+import hashlib
+import json
+
+from sqlalchemy import Boolean, Column, Integer, String, Text, Date, DateTime, Float, Index, UniqueConstraint, func
 from db import Base
+from discrepancy_engine import normalize_ref, parse_date_safe, vendor_key as _vendor_key
+
+# Bump when the promoted columns change so startup re-backfills older rows
+PARSED_FIELDS_VERSION = 4
+
+def _text_field(value):
+    return str(value).strip()[:255] if value not in (None, "") else None
+
+def _float_field(value):
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+def _date_field(value):
+    d = parse_date_safe(value) if isinstance(value, str) else None
+    return d.date() if d else None
+
+def _key_field(value):
+    return value[:255] or None
+
+def content_version(parsed: dict) -> str:
+    """Short hash of the parsed fields; a pair is re-evaluated when either side's changes."""
+    canonical = json.dumps(parsed, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
 
 class InvoiceData(Base):
     __tablename__ = "invoice_data"
@@ -8,6 +36,38 @@ class InvoiceData(Base):
     raw_text = Column(Text)
     parsed_data = Column(Text)
 
+    # Promoted from parsed_data so queries don't need json_extract
+    invoice_number = Column(String(255), index=True)
+    purchase_order_reference = Column(String(255), index=True)
+    vendor = Column(String(255), index=True)
+    total_amount = Column(Float)
+    invoice_date = Column(Date, index=True)
+    fields_version = Column(Integer)
+    # "llm", "rules" or "cache"; vendor templates are learned from "llm" rows
+    parse_source = Column(String(16))
+
+    # Normalized match keys used by incremental reconciliation
+    ref_key = Column(String(255), index=True)
+    vendor_key = Column(String(255), index=True)
+    content_version = Column(String(16))
+
+    @staticmethod
+    def fields_from_parsed(parsed: dict) -> dict:
+        parsed = parsed if isinstance(parsed, dict) else {}
+        return {
+            "invoice_number": _text_field(parsed.get("invoice_number")),
+            "purchase_order_reference": _text_field(parsed.get("purchase_order_reference")),
+            "vendor": _text_field(parsed.get("vendor")),
+            "total_amount": _float_field(parsed.get("total_amount")),
+            "invoice_date": _date_field(parsed.get("invoice_date")),
+            "ref_key": _key_field(normalize_ref(
+                parsed.get("purchase_order_reference") or parsed.get("invoice_number")
+            )),
+            "vendor_key": _key_field(_vendor_key(parsed.get("vendor"))),
+            "content_version": content_version(parsed),
+            "fields_version": PARSED_FIELDS_VERSION,
+        }
+
 class POData(Base):
     __tablename__ = "po_data"
     id = Column(Integer, primary_key=True, index=True)
@@ -15,10 +75,117 @@ class POData(Base):
     raw_text = Column(Text)
     parsed_data = Column(Text)
 
+    # Promoted from parsed_data so queries don't need json_extract
+    purchase_order_id = Column(String(255), index=True)
+    vendor = Column(String(255), index=True)
+    total_value = Column(Float)
+    order_date = Column(Date, index=True)
+    fields_version = Column(Integer)
+    parse_source = Column(String(16))
+
+    ref_key = Column(String(255), index=True)
+    vendor_key = Column(String(255), index=True)
+    content_version = Column(String(16))
+
+    @staticmethod
+    def fields_from_parsed(parsed: dict) -> dict:
+        parsed = parsed if isinstance(parsed, dict) else {}
+        return {
+            "purchase_order_id": _text_field(parsed.get("purchase_order_id")),
+            "vendor": _text_field(parsed.get("vendor")),
+            "total_value": _float_field(parsed.get("total_value")),
+            "order_date": _date_field(parsed.get("order_date")),
+            "ref_key": _key_field(normalize_ref(parsed.get("purchase_order_id"))),
+            "vendor_key": _key_field(_vendor_key(parsed.get("vendor"))),
+            "content_version": content_version(parsed),
+            "fields_version": PARSED_FIELDS_VERSION,
+        }
+
 class Discrepancy(Base):
     __tablename__ = "discrepancies"
+    # Keyset pagination and exports walk history newest first by (timestamp, id)
+    __table_args__ = (Index("ix_discrepancies_timestamp_id", "timestamp", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String(255))  # ✅ Add this line
     details = Column(Text)             # stores JSON or text summary
+    invoice_id = Column(Integer, index=True)
+    po_id = Column(Integer, index=True)
     timestamp = Column(DateTime, server_default=func.now())
+
+class ReconciliationStatus(Base):
+    """Current comparison result for each invoice/PO pair, kept up to date incrementally."""
+    __tablename__ = "reconciliation_status"
+    __table_args__ = (UniqueConstraint("invoice_id", "po_id", name="uq_reconciliation_pair"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, index=True, nullable=False)
+    po_id = Column(Integer, index=True, nullable=False)
+    matched_on = Column(String(16))                 # "reference", "vendor" or "manual"
+    invoice_version = Column(String(16))            # content_version of each side when evaluated
+    po_version = Column(String(16))
+    has_discrepancies = Column(Boolean, index=True)
+    discrepancy_fields = Column(Text)               # JSON list of differing fields
+    discrepancies = Column(Text)                    # JSON, as returned by detect_discrepancies
+    summary_text = Column(Text)
+    summary_version = Column(String(32))            # invoice_version + po_version the summary describes
+    evaluated_at = Column(DateTime, server_default=func.now())
+
+class Vendor(Base):
+    """One row per distinct vendor; name_key is its canonical name (see discrepancy_engine.canonical_vendor)."""
+    __tablename__ = "vendors"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name_key = Column(String(255), unique=True, index=True)
+    display_name = Column(String(255))
+    created_at = Column(DateTime, server_default=func.now())
+
+class VendorAlias(Base):
+    """Other canonical spellings of a vendor: confirmed by hand ("manual") or found by trigram similarity ("suggested")."""
+    __tablename__ = "vendor_aliases"
+
+    id = Column(Integer, primary_key=True, index=True)
+    alias_key = Column(String(255), unique=True, index=True)
+    vendor_id = Column(Integer, index=True, nullable=False)
+    similarity = Column(Float)                      # null for manual aliases
+    source = Column(String(16))                     # "suggested" or "manual"; only manual aliases resolve
+    created_at = Column(DateTime, server_default=func.now())
+
+class ParseCache(Base):
+    __tablename__ = "parse_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True)        # sha256(document + prompt + model)
+    document_sha256 = Column(String(64), index=True)               # sha256 of the uploaded bytes
+    extracted_text = Column(Text)
+    parsed_data = Column(Text)
+    size_bytes = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now(), index=True)
+
+class SqlQueryCache(Base):
+    __tablename__ = "sql_query_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True)   # sha256(prompt version + normalized request/template)
+    request_text = Column(Text)                                # normalized request or template, for inspection
+    sql = Column(Text)                                         # validated SELECT; templates use :p0, :p1, ...
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now())
+
+class SummaryCache(Base):
+    __tablename__ = "summary_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    summary_key = Column(String(64), unique=True, index=True)     # sha256(prompt version + canonical discrepancies)
+    summary_text = Column(Text)                                   # LLM-polished summary
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now())
+
+class AppState(Base):
+    __tablename__ = "app_state"
+
+    key = Column(String(64), primary_key=True)
+    value = Column(Integer, default=0)
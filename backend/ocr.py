@@ -1,25 +1,170 @@
-# ocr.py  – robust hybrid OCR extractor
-import pdfplumber
+# ocr.py  – Tesseract OCR backend: image preprocessing and adaptive OCR
+import os
+
+import numpy as np
 import pytesseract
 from PIL import Image
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """
-    Extracts text from a PDF.
-    Falls back to OCR if the page is image-based.
-    """
-    text = ""
-    try:
-        with pdfplumber.open(file_path) as pdf:
-            for i, page in enumerate(pdf.pages, start=1):
-                page_text = page.extract_text()
-                if not page_text:
-                    # Fallback OCR for scanned pages
-                    print(f"[OCR] Page {i}: no embedded text, using Tesseract fallback.")
-                    image = page.to_image(resolution=300).original
-                    page_text = pytesseract.image_to_string(image)
-                text += page_text or ""
-    except Exception as e:
-        print(f"[OCR ERROR] Could not read {file_path}: {e}")
-        return ""
-    return text.strip()
+# Number of processes used to rasterize + OCR scanned pages (1 = sequential).
+OCR_WORKERS = int(os.getenv("VERIFIN_OCR_WORKERS", "1"))
+OCR_RESOLUTION = 300
+
+# "full" OCRs every scanned page at OCR_RESOLUTION. "adaptive" starts at
+# OCR_FAST_RESOLUTION on a binarized, deskewed image, escalates only when
+# Tesseract's confidence is low, and reads just the header/totals regions.
+OCR_MODE = os.getenv("VERIFIN_OCR_MODE", "full").lower()
+OCR_FAST_RESOLUTION = int(os.getenv("VERIFIN_OCR_FAST_DPI", "150"))
+OCR_MIN_CONFIDENCE = float(os.getenv("VERIFIN_OCR_MIN_CONFIDENCE", "60"))
+
+# Fractions of the page height holding the header (number, vendor, PO
+# reference, date) and the totals block.
+HEADER_FRACTION = 0.35
+TOTALS_FRACTION = 0.35
+MAX_SKEW_DEGREES = 5.0
+
+
+# ---------- Adaptive OCR ----------
+def _otsu_threshold(gray: np.ndarray) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    mass_bg = np.cumsum(hist * levels)
+    mean_bg = mass_bg / np.maximum(weight_bg, 1)
+    mean_fg = (mass_bg[-1] - mass_bg) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+
+def _estimate_skew(ink: np.ndarray, max_samples: int = 50000) -> float:
+    """
+    Angle (degrees) of the text lines, found by shearing the ink pixels and
+    keeping the angle whose row histogram is sharpest.
+    """
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_samples:
+        pick = np.random.default_rng(0).choice(len(ys), max_samples, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + 0.01, 0.25):
+        rows = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+        counts = np.bincount(rows - rows.min())
+        score = float(np.dot(counts, counts))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_image(image: Image.Image) -> Image.Image:
+    """
+    Binarize (Otsu) and deskew in one pass: the ink mask used for the
+    threshold is the same one the skew is measured on, and the page is
+    rotated once.
+    """
+    gray = np.asarray(image.convert("L"))
+    ink = gray < _otsu_threshold(gray)
+    angle = _estimate_skew(ink)
+    binary = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+    if abs(angle) >= 0.25:
+        binary = binary.rotate(angle, resample=Image.NEAREST, expand=False, fillcolor=255)
+    return binary
+
+
+def crop_regions(image: Image.Image, regions) -> Image.Image:
+    """Stack the requested regions ("header", "totals") of a page into one image."""
+    if not regions:
+        return image
+    width, height = image.size
+    boxes = []
+    if "header" in regions:
+        boxes.append((0, 0, width, int(height * HEADER_FRACTION)))
+    if "totals" in regions:
+        boxes.append((0, int(height * (1 - TOTALS_FRACTION)), width, height))
+    # Header and totals overlap on short pages; OCR the page once instead.
+    if len(boxes) == 2 and boxes[0][3] >= boxes[1][1]:
+        return image
+    crops = [image.crop(box) for box in boxes]
+    stacked = Image.new(image.mode, (width, sum(c.size[1] for c in crops)), 255)
+    top = 0
+    for crop in crops:
+        stacked.paste(crop, (0, top))
+        top += crop.size[1]
+    return stacked
+
+
+def _ocr_with_confidence(image: Image.Image):
+    """One Tesseract call returning (text, mean word confidence 0-100)."""
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    lines, confidences = {}, []
+    for i, word in enumerate(data["text"]):
+        word = (word or "").strip()
+        if not word:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        conf = float(data["conf"][i])
+        if conf >= 0:
+            confidences.append(conf)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+
+def adaptive_ocr(render, regions=None):
+    """
+    render(dpi) returns a page image at that resolution. OCR starts at
+    OCR_FAST_RESOLUTION and re-renders at OCR_RESOLUTION only if confidence is
+    below OCR_MIN_CONFIDENCE. When the totals region is requested but no
+    total was read, the whole page is OCR'd at the same resolution.
+    Returns (text, method) where method records whether it escalated.
+    """
+    for dpi in (OCR_FAST_RESOLUTION, OCR_RESOLUTION):
+        page = preprocess_image(render(dpi))
+        text, confidence = _ocr_with_confidence(crop_regions(page, regions))
+        if regions and "totals" in regions and "total" not in text.lower():
+            text, confidence = _ocr_with_confidence(page)
+        if confidence >= OCR_MIN_CONFIDENCE:
+            break
+    return text, "tesseract_fast" if dpi < OCR_RESOLUTION else "tesseract_escalated"
+
+
+def page_regions(page_index: int, page_count: int):
+    """
+    Regions to OCR on a scanned page in adaptive mode: the header lives on the
+    first page and the totals on the last, so middle pages are skipped (None).
+    """
+    regions = ()
+    if page_index == 0:
+        regions += ("header",)
+    if page_index == page_count - 1:
+        regions += ("totals",)
+    return regions or None
+
+
+def image_renderer(image):
+    """
+    render(dpi) for an already-rasterized image: downscale it relative to its
+    own DPI (assumed OCR_RESOLUTION when the file doesn't say), never upscale.
+    """
+    source_dpi = float((image.info.get("dpi") or (OCR_RESOLUTION,))[0]) or OCR_RESOLUTION
+
+    def render(dpi):
+        scale = dpi / source_dpi
+        if scale >= 1:
+            return image
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        return image.resize(size, Image.LANCZOS)
+
+    return render
+
+
+def ocr_render(render, regions=None, adaptive: bool = False):
+    """
+    OCR one page given render(dpi) -> PIL image. Full mode reads the whole
+    page at OCR_RESOLUTION; adaptive mode goes through adaptive_ocr.
+    Returns (text, method).
+    """
+    if not adaptive:
+        return pytesseract.image_to_string(render(OCR_RESOLUTION)) or "", "tesseract"
+    return adaptive_ocr(render, regions)
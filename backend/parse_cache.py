@@ -0,0 +1,150 @@
+# parse_cache.py  – content-addressed cache of OCR text + parsed JSON
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func
+
+from db import SessionLocal
+from models import ParseCache
+from metrics import PARSE_CACHE_LOOKUPS
+
+# Upper bound on the summed size of cached text + JSON; least recently used go first.
+MAX_CACHE_BYTES = int(os.getenv("VERIFIN_PARSE_CACHE_MAX_MB", "256")) * 1024 * 1024
+CACHE_ENABLED = os.getenv("VERIFIN_PARSE_CACHE", "1") != "0"
+
+_stats = {"hits": 0, "text_hits": 0, "misses": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file on disk, read in chunks."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_cache_key(document_sha256: str, prompt: str, model: str) -> str:
+    """Entries are only reused when the document, prompt template and model all match."""
+    prompt_hash = hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{document_sha256}:{prompt_hash}".encode("utf-8")).hexdigest()
+
+
+def get_parsed(cache_key: str) -> Optional[dict]:
+    """Return the cached parsed JSON for cache_key, or None on a miss."""
+    if not CACHE_ENABLED:
+        return None
+    db = SessionLocal()
+    try:
+        entry = db.query(ParseCache).filter(ParseCache.cache_key == cache_key).first()
+        if entry is None:
+            _count("misses")
+            PARSE_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        entry.last_used_at = datetime.utcnow()
+        db.commit()
+        _count("hits")
+        PARSE_CACHE_LOOKUPS.inc(result="hit")
+        return json.loads(entry.parsed_data)
+    finally:
+        db.close()
+
+
+def get_text(document_sha256: str) -> Optional[str]:
+    """
+    Return previously extracted text for the same bytes, regardless of prompt or
+    model, so a prompt change still skips OCR.
+    """
+    if not CACHE_ENABLED:
+        return None
+    db = SessionLocal()
+    try:
+        entry = (
+            db.query(ParseCache)
+            .filter(ParseCache.document_sha256 == document_sha256)
+            .order_by(ParseCache.last_used_at.desc())
+            .first()
+        )
+        if entry is None or not entry.extracted_text:
+            return None
+        _count("text_hits")
+        PARSE_CACHE_LOOKUPS.inc(result="text_hit")
+        return entry.extracted_text
+    finally:
+        db.close()
+
+
+def put(cache_key: str, document_sha256: str, extracted_text: str, parsed_data: dict) -> None:
+    """Store a successful parse and evict least recently used entries over the size bound."""
+    if not CACHE_ENABLED:
+        return
+    parsed_json_text = json.dumps(parsed_data, default=str)
+    size = len(extracted_text.encode("utf-8")) + len(parsed_json_text.encode("utf-8"))
+
+    db = SessionLocal()
+    try:
+        entry = db.query(ParseCache).filter(ParseCache.cache_key == cache_key).first()
+        if entry is None:
+            entry = ParseCache(cache_key=cache_key, document_sha256=document_sha256)
+            db.add(entry)
+        entry.extracted_text = extracted_text
+        entry.parsed_data = parsed_json_text
+        entry.size_bytes = size
+        entry.last_used_at = datetime.utcnow()
+        db.commit()
+        _evict(db)
+    except Exception as e:
+        # Two workers finishing the same document race on the unique key; either copy is fine.
+        db.rollback()
+        print(f"[PARSE CACHE] Could not store {cache_key[:12]}: {e}")
+    finally:
+        db.close()
+
+
+def _evict(db) -> None:
+    total = db.query(func.coalesce(func.sum(ParseCache.size_bytes), 0)).scalar()
+    if total <= MAX_CACHE_BYTES:
+        return
+    victims = []
+    oldest_first = db.query(ParseCache.id, ParseCache.size_bytes).order_by(
+        ParseCache.last_used_at.asc(), ParseCache.id.asc()
+    )
+    for entry_id, size in oldest_first:
+        if total <= MAX_CACHE_BYTES:
+            break
+        total -= size or 0
+        victims.append(entry_id)
+    db.query(ParseCache).filter(ParseCache.id.in_(victims)).delete(synchronize_session=False)
+    db.commit()
+    _count("evictions", len(victims))
+
+
+def stats() -> dict:
+    """Hit/miss counters for this process plus the current size of the cache."""
+    with _stats_lock:
+        counters = dict(_stats)
+    db = SessionLocal()
+    try:
+        entries, total = db.query(
+            func.count(ParseCache.id), func.coalesce(func.sum(ParseCache.size_bytes), 0)
+        ).one()
+    finally:
+        db.close()
+    lookups = counters["hits"] + counters["misses"]
+    counters.update(
+        entries=entries,
+        total_bytes=total,
+        max_bytes=MAX_CACHE_BYTES,
+        hit_ratio=round(counters["hits"] / lookups, 4) if lookups else 0.0,
+    )
+    return counters
@@ -1,18 +1,31 @@
 # parser_local.py  – improved parser with hybrid OCR + strong prompt
 import os
 import json
-from dotenv import load_dotenv
-from openai import OpenAI
-from typing import Union
-from ocr import extract_text_from_pdf
-from ocr_worker import extract_text as extract_text_from_bytes
+from typing import Optional, Union
+import components
+import parse_cache
+import llm_gateway
+import field_extractor
+import chunking
+from metrics import PARSE_PATHS, stage_timer
 
-load_dotenv()
+# Characters of document text sent to the LLM in a single prompt (limit to avoid token overflow)
+MAX_DOCUMENT_CHARS = 8000
 
-client = OpenAI(
-    api_key=os.getenv("SHIVAAY_API_KEY"),
-    base_url=os.getenv("SHIVAAY_BASE_URL", "https://api.futurixai.com/api/shivaay/v1")
-)
+# ---------- Chunked parsing ----------
+# "single" sends the first MAX_DOCUMENT_CHARS in one prompt; "chunked" splits
+# the document by page, sends only the chunks most likely to hold the fields
+# (in parallel) and merges the results; "auto" chunks documents that would
+# not fit in one prompt.
+PARSE_MODE = os.getenv("VERIFIN_PARSE_MODE", "auto")
+# Extraction limit when chunking may be used (the whole document is needed to find its totals page)
+MAX_EXTRACT_CHARS = int(os.getenv("VERIFIN_MAX_EXTRACT_CHARS", "200000"))
+CHUNK_CHARS = int(os.getenv("VERIFIN_CHUNK_CHARS", "3000"))
+# Document-text tokens sent per document across all chunk calls (~4 characters per token)
+PARSE_TOKEN_BUDGET = int(os.getenv("VERIFIN_PARSE_TOKEN_BUDGET", "2000"))
+MAX_CHUNK_CALLS = int(os.getenv("VERIFIN_MAX_CHUNK_CALLS", "4"))
+CHUNK_MAX_TOKENS = int(os.getenv("VERIFIN_CHUNK_MAX_TOKENS", "400"))
+CHARS_PER_TOKEN = 4
 
 def _safe_load_json(text: str) -> Union[dict, str]:
     """Try to parse text as JSON, otherwise return cleaned text."""
@@ -25,63 +38,48 @@ def _safe_load_json(text: str) -> Union[dict, str]:
         except Exception:
             return cleaned
 
-def parse_with_shivaay_ai(file_path: str) -> dict:
-    """
-    - Extracts text using pdfplumber/pytesseract (hybrid OCR)
-    - Calls Shivaay LLM for structured JSON
-    - Returns dict or {"raw_parsed": "..."} fallback
-    """
-    if not os.path.exists(file_path):
-        return {"error": f"File not found: {file_path}"}
+PARSER_SYSTEM_PROMPT = "You are a financial document parser. Output only JSON."
 
-    ext = file_path.lower().split(".")[-1]
-    extracted_text = ""
-    prompt = ""
+PARSER_PROMPT_HEADER = (
+    "You are a financial document parser for invoices and purchase orders. "
+    "Always output valid JSON only — no explanation or markdown. "
+    "If a field is missing, set it to null.\n\n"
+    "Equivalent fields:\n"
+    "- invoice_number ≈ purchase_order_reference ≈ purchase_order_id\n"
+    "- total_amount ≈ total_value\n"
+    "- invoice_date ≈ order_date (minor differences are normal)\n\n"
+    "Expected keys:\n"
+    "invoice_number, vendor, purchase_order_reference, total_amount, invoice_date, "
+    "purchase_order_id, total_value, order_date\n\n"
+    "Document text:\n"
+)
 
-    # ---------- OCR Extraction ----------
+PARSER_CHUNK_NOTE = (
+    "The text below is an excerpt of a longer document: the parts most likely to contain these fields. "
+    "Set any field that does not appear in it to null.\n\n"
+)
+
+
+def _cache_variant() -> str:
+    """What the cached result depends on besides the document, prompt and model."""
+    if PARSE_MODE == "single":
+        return str(MAX_DOCUMENT_CHARS)
+    return f"{MAX_DOCUMENT_CHARS}|{PARSE_MODE}|{CHUNK_CHARS}|{PARSE_TOKEN_BUDGET}|{MAX_CHUNK_CALLS}|{PARSER_CHUNK_NOTE}"
+
+
+def _extract_document_text(file_path: str) -> str:
+    max_chars = MAX_DOCUMENT_CHARS if PARSE_MODE == "single" else MAX_EXTRACT_CHARS
     try:
-        if ext == "pdf":
-            extracted_text = extract_text_from_pdf(file_path)
-        else:
-            with open(file_path, "rb") as f:
-                file_bytes = f.read()
-            extracted_text = extract_text_from_bytes(file_bytes, os.path.basename(file_path))
+        # The format is sniffed from the bytes, so a mislabelled upload still parses.
+        # The PDF/OCR stack is imported on first use (or by the startup prewarm).
+        return components.get("extraction").extract_file(file_path, max_chars=max_chars)
     except Exception as e:
         print(f"[PARSER OCR ERROR] {file_path}: {e}")
-        extracted_text = ""
+        return ""
 
-    if not extracted_text.strip():
-        return {"error": "No text extracted from document (possibly image-only or unreadable)."}
-
-    # ---------- Build Prompt ----------
-    prompt = (
-        "You are a financial document parser for invoices and purchase orders. "
-        "Always output valid JSON only — no explanation or markdown. "
-        "If a field is missing, set it to null.\n\n"
-        "Equivalent fields:\n"
-        "- invoice_number ≈ purchase_order_reference ≈ purchase_order_id\n"
-        "- total_amount ≈ total_value\n"
-        "- invoice_date ≈ order_date (minor differences are normal)\n\n"
-        "Expected keys:\n"
-        "invoice_number, vendor, purchase_order_reference, total_amount, invoice_date, "
-        "purchase_order_id, total_value, order_date\n\n"
-        "Document text:\n"
-        f"{extracted_text[:8000]}"  # limit to avoid token overflow
-    )
 
-    # ---------- Call Shivaay LLM ----------
-    try:
-        completion = client.chat.completions.create(
-            model=os.getenv("SHIVAAY_MODEL", "shivaay"),
-            messages=[
-                {"role": "system", "content": "You are a financial document parser. Output only JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=1200
-        )
-
-        raw = completion.choices[0].message.content.strip()
+def _recover_json(raw: str) -> dict:
+    with stage_timer("json_recovery"):
         parsed = _safe_load_json(raw)
 
         # Try to recover embedded JSON if still text
@@ -94,13 +92,126 @@ def parse_with_shivaay_ai(file_path: str) -> dict:
             except Exception:
                 pass
 
-        # Guarantee dictionary return
-        if isinstance(parsed, dict):
+    # Guarantee dictionary return
+    if isinstance(parsed, dict):
+        return parsed
+    return {"raw_parsed": parsed if isinstance(parsed, str) else str(parsed)}
+
+
+def _call_llm_parser(prompt: str, file_path: str) -> dict:
+    try:
+        raw = llm_gateway.chat(
+            [
+                {"role": "system", "content": PARSER_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.1,
+            max_tokens=1200
+        )
+        parsed = _recover_json(raw)
+        if "raw_parsed" not in parsed:
             print(f"[PARSER] Parsed keys: {list(parsed.keys())}")
-            return parsed
-        else:
-            return {"raw_parsed": parsed if isinstance(parsed, str) else str(parsed)}
+        return parsed
 
     except Exception as e:
         print(f"[PARSER LLM ERROR] {file_path}: {e}")
         return {"raw_parsed": ""}
+
+
+def _call_llm_chunked(text: str, file_path: str) -> dict:
+    """Parse only the chunks most likely to hold the fields, in parallel, and merge the results."""
+    with stage_timer("chunk_selection"):
+        chunks = chunking.split_chunks(text, CHUNK_CHARS)
+        selected = chunking.select_chunks(chunks, PARSE_TOKEN_BUDGET * CHARS_PER_TOKEN, MAX_CHUNK_CALLS)
+    print(f"[PARSER] {os.path.basename(file_path)}: sending {len(selected)} of {len(chunks)} chunks "
+          f"(pages {sorted({c.page for c in selected})}).")
+    requests = [
+        [
+            {"role": "system", "content": PARSER_SYSTEM_PROMPT},
+            {"role": "user", "content": PARSER_CHUNK_NOTE + PARSER_PROMPT_HEADER
+             + f"[Page {chunk.page}]\n" + chunk.text},
+        ]
+        for chunk in selected
+    ]
+    results = []
+    for chunk, raw in zip(selected, llm_gateway.chat_many(requests, temperature=0.1, max_tokens=CHUNK_MAX_TOKENS)):
+        if isinstance(raw, Exception):
+            print(f"[PARSER LLM ERROR] {file_path} page {chunk.page}: {raw}")
+            continue
+        parsed = _recover_json(raw)
+        if "raw_parsed" not in parsed:
+            results.append((chunk, parsed))
+    if not results:
+        return {"raw_parsed": ""}
+    with stage_timer("chunk_merge"):
+        parsed = chunking.merge_results(results)
+    print(f"[PARSER] Parsed keys: {list(parsed.keys())}")
+    return parsed
+
+
+def parse_document(file_path: str, content_hash: Optional[str] = None) -> tuple:
+    """
+    - Returns the cached result when the same bytes were parsed with the same prompt/model
+    - Extracts text using pdfplumber/pypdfium2/pytesseract (hybrid OCR)
+    - Tries the rule-based field extractor; calls Shivaay LLM only if it is unsure
+    - Long documents are parsed in chunks (see PARSE_MODE) instead of being truncated
+    - Returns (parsed dict or {"raw_parsed": "..."} fallback, extracted text, source)
+
+    source is "cache", "rules" or "llm". content_hash is the SHA-256 of the
+    file, if the caller already computed it.
+    """
+    if not os.path.exists(file_path):
+        return {"error": f"File not found: {file_path}"}, "", None
+
+    # ---------- Parse cache lookup ----------
+    document_sha256 = content_hash or parse_cache.file_sha256(file_path)
+    model = os.getenv("SHIVAAY_MODEL", "shivaay")
+    cache_key = parse_cache.make_cache_key(
+        document_sha256, PARSER_SYSTEM_PROMPT + PARSER_PROMPT_HEADER + _cache_variant(), model
+    )
+    cached = parse_cache.get_parsed(cache_key)
+    if cached is not None:
+        print(f"[PARSER] Cache hit for {os.path.basename(file_path)}")
+        PARSE_PATHS.inc(path="cache")
+        return cached, parse_cache.get_text(document_sha256) or "", "cache"
+
+    # ---------- OCR Extraction ----------
+    extracted_text = parse_cache.get_text(document_sha256)
+    # Text cached before page breaks were recorded may have been cut at MAX_DOCUMENT_CHARS
+    if extracted_text is None or (
+        PARSE_MODE != "single" and len(extracted_text) >= MAX_DOCUMENT_CHARS
+        and chunking.PAGE_BREAK not in extracted_text
+    ):
+        extracted_text = _extract_document_text(file_path)
+
+    if not extracted_text.strip():
+        return {"error": "No text extracted from document (possibly image-only or unreadable)."}, "", None
+
+    # ---------- Rule-based fast path ----------
+    with stage_timer("rule_extraction"):
+        parsed = field_extractor.extract_fields(extracted_text)
+    if parsed is not None:
+        print(f"[PARSER] Rule-based extraction succeeded for {os.path.basename(file_path)}, skipping LLM.")
+        PARSE_PATHS.inc(path="rules")
+        parse_cache.put(cache_key, document_sha256, extracted_text, parsed)
+        return parsed, extracted_text, "rules"
+
+    # ---------- Call Shivaay LLM ----------
+    if PARSE_MODE == "chunked" or (PARSE_MODE == "auto" and len(extracted_text) > MAX_DOCUMENT_CHARS):
+        parsed = _call_llm_chunked(extracted_text, file_path)
+        PARSE_PATHS.inc(path="llm_chunked")
+    else:
+        with stage_timer("prompt_build"):
+            prompt = PARSER_PROMPT_HEADER + extracted_text[:MAX_DOCUMENT_CHARS]
+        parsed = _call_llm_parser(prompt, file_path)
+        PARSE_PATHS.inc(path="llm")
+
+    # Only clean parses are cached; fallbacks should be retried on the next upload
+    if "raw_parsed" not in parsed and "error" not in parsed:
+        parse_cache.put(cache_key, document_sha256, extracted_text, parsed)
+    return parsed, extracted_text, "llm"
+
+
+def parse_with_shivaay_ai(file_path: str, content_hash: Optional[str] = None) -> dict:
+    """Parsed fields only; see parse_document()."""
+    return parse_document(file_path, content_hash=content_hash)[0]
@@ -0,0 +1,49 @@
+# profiler.py  – optional low-overhead sampling profiler
+#
+# Samples every thread's stack at a fixed interval and aggregates them as
+# "collapsed" stacks (frame;frame;frame count), the input format of
+# flamegraph.pl and speedscope. Only reachable through /debug/profile when
+# VERIFIN_ENABLE_PROFILER=1.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_ENABLED = os.getenv("VERIFIN_ENABLE_PROFILER", "0") == "1"
+MAX_PROFILE_SECONDS = 60
+
+_profile_lock = threading.Lock()
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sample(seconds: float = 5.0, interval: float = 0.005) -> str:
+    """
+    Sample all threads (except the sampler) for `seconds` and return collapsed
+    stacks, most frequent first. Only one profile runs at a time.
+    """
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stacks[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
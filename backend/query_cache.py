@@ -0,0 +1,193 @@
+# query_cache.py  – caches for the natural-language → SQL path
+#
+# 1) SQL cache (persistent, in sql_query_cache): normalized request → validated
+#    SQL. Requests that only differ in literals ("invoices over 5000" vs
+#    "invoices over 12000") share one parameterized template.
+# 2) Result cache (in-process LRU): (sql, params, data version) → rows. Every
+#    write to invoice/PO/discrepancy data bumps the data version, so stale
+#    results are never served. Summaries of those results are cached alongside.
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update
+
+from db import SessionLocal
+from models import SqlQueryCache, AppState
+
+RESULT_CACHE_SIZE = int(os.getenv("VERIFIN_RESULT_CACHE_SIZE", "256"))
+
+_LITERAL = re.compile(
+    r"'(?P<sq>[^']*)'"
+    r'|"(?P<dq>[^"]*)"'
+    r"|(?P<date>\b\d{4}-\d{2}-\d{2}\b|\b\d{2}-\d{2}-\d{4}\b)"
+    r"|(?P<num>(?<![\w.])\d+(?:\.\d+)?(?![\w.]))"
+)
+
+
+class LRUCache:
+    """Small thread-safe LRU map."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+result_cache = LRUCache(RESULT_CACHE_SIZE)
+# LLM summaries of query results, keyed by the result itself
+summary_cache = LRUCache(RESULT_CACHE_SIZE)
+
+
+# ---------- Request normalization ----------
+def normalize_request(request: str):
+    """
+    Returns (template, literals): the request with whitespace collapsed, each
+    literal replaced by {0}, {1}, ... and lowercased; and the literals as
+    (kind, value) pairs with their original case.
+    """
+    collapsed = " ".join(request.split()).rstrip("?.! ")
+    literals = []
+
+    def _placeholder(m):
+        if m.group("num") is not None:
+            literals.append(("num", m.group("num")))
+        elif m.group("date") is not None:
+            literals.append(("str", m.group("date")))
+        else:
+            literals.append(("str", m.group("sq") if m.group("sq") is not None else m.group("dq")))
+        return "{" + str(len(literals) - 1) + "}"
+
+    template = _LITERAL.sub(_placeholder, collapsed).lower()
+    return template, literals
+
+
+def _bind(literals) -> dict:
+    params = {}
+    for i, (kind, value) in enumerate(literals):
+        if kind == "num":
+            params[f"p{i}"] = float(value) if "." in value else int(value)
+        else:
+            params[f"p{i}"] = value
+    return params
+
+
+def _templatize(sql: str, literals) -> Optional[str]:
+    """Swap each literal in sql for :pN, or None if any is absent or ambiguous."""
+    for i, (kind, value) in enumerate(literals):
+        if kind == "num":
+            pattern = re.compile(r"(?<![\w.:'])" + re.escape(value) + r"(?![\w.'])")
+        else:
+            pattern = re.compile("'" + re.escape(value) + "'")
+        if len(pattern.findall(sql)) != 1:
+            return None
+        sql = pattern.sub(f":p{i}", sql)
+    return sql
+
+
+def _key(prompt_version: str, kind: str, text: str) -> str:
+    return hashlib.sha256(f"{prompt_version}\n{kind}\n{text}".encode("utf-8")).hexdigest()
+
+
+# ---------- SQL cache ----------
+def lookup_sql(request: str, prompt_version: str):
+    """Return (sql, params) for a previously validated request, or None."""
+    template, literals = normalize_request(request)
+    exact = template + json.dumps(literals)
+    candidates = [(_key(prompt_version, "exact", exact), {})]
+    if literals:
+        candidates.append((_key(prompt_version, "template", template), _bind(literals)))
+
+    db = SessionLocal()
+    try:
+        for cache_key, params in candidates:
+            entry = db.query(SqlQueryCache).filter(SqlQueryCache.cache_key == cache_key).first()
+            if entry is None:
+                continue
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_used_at = datetime.utcnow()
+            db.commit()
+            return entry.sql, params
+        return None
+    finally:
+        db.close()
+
+
+def store_sql(request: str, prompt_version: str, sql: str) -> None:
+    """Remember SQL that executed successfully, plus a template when the literals map cleanly."""
+    template, literals = normalize_request(request)
+    exact = template + json.dumps(literals)
+    entries = [(_key(prompt_version, "exact", exact), exact, sql)]
+    if literals:
+        sql_template = _templatize(sql, literals)
+        if sql_template is not None:
+            entries.append((_key(prompt_version, "template", template), template, sql_template))
+
+    db = SessionLocal()
+    try:
+        for cache_key, request_text, entry_sql in entries:
+            if db.query(SqlQueryCache.id).filter(SqlQueryCache.cache_key == cache_key).first():
+                continue
+            db.add(SqlQueryCache(cache_key=cache_key, request_text=request_text, sql=entry_sql, hits=0))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[SQL CACHE] Could not store query: {e}")
+    finally:
+        db.close()
+
+
+# ---------- Data version ----------
+def data_version() -> int:
+    db = SessionLocal()
+    try:
+        state = db.get(AppState, "data_version")
+        return state.value if state else 0
+    finally:
+        db.close()
+
+
+def bump_data_version(db=None) -> None:
+    """Invalidate cached query results; call after committing invoice/PO/discrepancy writes."""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        updated = db.execute(
+            update(AppState).where(AppState.key == "data_version").values(value=AppState.value + 1)
+        ).rowcount
+        if not updated:
+            db.add(AppState(key="data_version", value=1))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[SQL CACHE] Could not bump data version: {e}")
+    finally:
+        if own_session:
+            db.close()
+
+
+def result_key(sql: str, params: dict, version: int) -> str:
+    return hashlib.sha256(json.dumps([sql, params, version], sort_keys=True).encode("utf-8")).hexdigest()
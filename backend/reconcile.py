@@ -0,0 +1,307 @@
+# reconcile.py  – matching invoices against purchase orders, incrementally
+#
+# Every invoice/PO pair that has been compared has a row in
+# reconciliation_status holding the result and the content_version of both
+# documents at the time. New uploads only re-evaluate the invoices whose
+# reference or vendor keys they share, and a pair is only recompared when
+# one side's version changed. Invoices without a reference match fall back to
+# the VERIFIN_VENDOR_FALLBACK_POS POs of their vendor closest in amount, so a
+# busy vendor's unmatched invoices don't pair with every one of its POs.
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+
+from discrepancy_engine import (
+    INVOICE_COLUMNS, PO_COLUMNS, detect_discrepancies, detect_discrepancies_batch,
+    records_to_columns,
+)
+from models import InvoiceData, POData, Discrepancy, ReconciliationStatus
+from summaries import render_summary
+import vendors
+
+# Re-evaluate affected pairs as soon as documents are stored.
+AUTO_RECONCILE = os.getenv("VERIFIN_AUTO_RECONCILE", "1") != "0"
+# POs per unmatched invoice compared through the vendor fallback.
+VENDOR_FALLBACK_POS = int(os.getenv("VERIFIN_VENDOR_FALLBACK_POS", "1"))
+# Bound on the size of IN (...) lists sent to the database.
+KEY_CHUNK_SIZE = 500
+
+def invoice_ref(parsed: dict):
+    return parsed.get("purchase_order_reference") or parsed.get("invoice_number")
+
+
+def _load(value) -> dict:
+    try:
+        parsed = json.loads(value or "{}")
+    except Exception:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def _chunks(values, size: int = KEY_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def build_po_index(po_rows):
+    """
+    One pass over the POs: returns ({ref_key: [po, ...]}, {vendor_key: [po, ...]}),
+    where each po row is (id, filename, parsed_data, ref_key, vendor_key,
+    content_version, total_value).
+    """
+    by_ref, by_vendor = defaultdict(list), defaultdict(list)
+    for po in po_rows:
+        if po.ref_key:
+            by_ref[po.ref_key].append(po)
+        if po.vendor_key:
+            by_vendor[po.vendor_key].append(po)
+    return by_ref, by_vendor
+
+
+def _amount_distance(invoice, po) -> float:
+    if invoice.total_amount is None or po.total_value is None:
+        return float("inf")
+    return abs(invoice.total_amount - po.total_value)
+
+
+def candidate_pos(invoice, by_ref, by_vendor):
+    """
+    POs sharing the invoice's reference; falls back to the VENDOR_FALLBACK_POS
+    POs from the same vendor closest in amount (newest first on ties).
+    Returns (pos, matched_on).
+    """
+    if invoice.ref_key and invoice.ref_key in by_ref:
+        return by_ref[invoice.ref_key], "reference"
+    pos = by_vendor.get(invoice.vendor_key, [])
+    return sorted(pos, key=lambda po: (_amount_distance(invoice, po), -po.id))[:VENDOR_FALLBACK_POS], "vendor"
+
+
+_PO_COLUMNS = (POData.id, POData.filename, POData.parsed_data, POData.ref_key, POData.vendor_key,
+               POData.content_version, POData.total_value)
+_INVOICE_COLUMNS = (InvoiceData.id, InvoiceData.filename, InvoiceData.parsed_data, InvoiceData.ref_key,
+                    InvoiceData.vendor_key, InvoiceData.content_version, InvoiceData.total_amount)
+
+
+def _pos_for(db, invoices) -> list:
+    """
+    Only the POs that could match these invoices: by reference key, and by
+    vendor key for the invoices no PO matches by reference.
+    """
+    found = {}
+    for chunk in _chunks({inv.ref_key for inv in invoices if inv.ref_key}):
+        for po in db.query(*_PO_COLUMNS).filter(POData.ref_key.in_(chunk)):
+            found[po.id] = po
+    matched_refs = {po.ref_key for po in found.values()}
+    vendors = {inv.vendor_key for inv in invoices if inv.vendor_key and inv.ref_key not in matched_refs}
+    for chunk in _chunks(vendors):
+        for po in db.query(*_PO_COLUMNS).filter(POData.vendor_key.in_(chunk)):
+            found[po.id] = po
+    return list(found.values())
+
+
+def _status_result(status) -> dict:
+    return {
+        "invoice_id": status.invoice_id,
+        "po_id": status.po_id,
+        "matched_on": status.matched_on,
+        "has_discrepancies": bool(status.has_discrepancies),
+        "fields": json.loads(status.discrepancy_fields or "[]"),
+    }
+
+
+def _apply(status, invoice, po, matched_on, discrepancies) -> None:
+    fields = [f for f in discrepancies if f != "status"]
+    status.matched_on = matched_on
+    status.invoice_version = invoice.content_version
+    status.po_version = po.content_version
+    status.has_discrepancies = bool(fields)
+    status.discrepancy_fields = json.dumps(fields)
+    status.discrepancies = json.dumps(discrepancies, default=str)
+    status.evaluated_at = datetime.utcnow()
+
+
+def reconcile_invoices(db, invoice_ids, force: bool = False) -> dict:
+    """
+    Bring reconciliation_status up to date for these invoices: pairs that are no
+    longer candidates are dropped, new or changed pairs are compared in one
+    vectorized pass (and logged to the discrepancies table), unchanged pairs
+    are left alone unless force is set (e.g. after the matching rules changed).
+    """
+    vendors.refresh()
+    invoices = []
+    for chunk in _chunks(set(invoice_ids)):
+        invoices.extend(db.query(*_INVOICE_COLUMNS).filter(InvoiceData.id.in_(chunk)))
+    pos = _pos_for(db, invoices)
+    by_ref, by_vendor = build_po_index(pos)
+
+    existing = {}
+    for chunk in _chunks([inv.id for inv in invoices]):
+        for status in db.query(ReconciliationStatus).filter(ReconciliationStatus.invoice_id.in_(chunk)):
+            existing[(status.invoice_id, status.po_id)] = status
+
+    to_compare, unchanged, unmatched, wanted = [], [], [], set()
+    for invoice in invoices:
+        candidates, matched_on = candidate_pos(invoice, by_ref, by_vendor)
+        if not candidates:
+            unmatched.append(invoice.id)
+        for po in candidates:
+            key = (invoice.id, po.id)
+            wanted.add(key)
+            status = existing.get(key)
+            if (not force and status is not None and status.invoice_version == invoice.content_version
+                    and status.po_version == po.content_version and status.matched_on == matched_on):
+                unchanged.append(status)
+            else:
+                to_compare.append((invoice, po, matched_on, status))
+
+    # Candidates can change when a better (reference) match arrives; manual pairs stay.
+    stale = [s for key, s in existing.items() if key not in wanted and s.matched_on != "manual"]
+    for status in stale:
+        db.delete(status)
+
+    all_discrepancies = detect_discrepancies_batch(
+        records_to_columns([_load(inv.parsed_data) for inv, _, _, _ in to_compare], INVOICE_COLUMNS),
+        records_to_columns([_load(po.parsed_data) for _, po, _, _ in to_compare], PO_COLUMNS),
+    )
+
+    history, changed = [], []
+    for (invoice, po, matched_on, status), discrepancies in zip(to_compare, all_discrepancies):
+        if status is None:
+            status = ReconciliationStatus(invoice_id=invoice.id, po_id=po.id)
+            db.add(status)
+        _apply(status, invoice, po, matched_on, discrepancies)
+        # Record the summary this history row carries, so /detect-discrepancy
+        # updates the row for these versions instead of logging the pair again
+        status.summary_text = render_summary(discrepancies)
+        status.summary_version = f"{status.invoice_version}{status.po_version}"
+        changed.append(status)
+        history.append(Discrepancy(
+            description=f"Invoice {invoice.filename} vs PO {po.filename}",
+            invoice_id=invoice.id,
+            po_id=po.id,
+            details=json.dumps({
+                "invoice_id": invoice.id,
+                "po_id": po.id,
+                "discrepancies": discrepancies,
+                "summary_text": status.summary_text
+            }, indent=2, default=str)
+        ))
+
+    if history:
+        db.bulk_save_objects(history)
+    db.commit()
+
+    results = [_status_result(s) for s in changed + unchanged]
+    return {
+        "invoices_checked": len(invoices),
+        "pos_indexed": len(pos),
+        "pairs_evaluated": len(changed),
+        "pairs_unchanged": len(unchanged),
+        "pairs_removed": len(stale),
+        "pairs_with_discrepancies": sum(1 for r in results if r["has_discrepancies"]),
+        "unmatched_invoice_ids": unmatched,
+        "results": results,
+    }
+
+
+def affected_invoice_ids(db, po_ids) -> set:
+    """
+    Invoices sharing a reference key with any of these POs, plus the invoices
+    of their vendors that no PO matches by reference (the vendor fallback).
+    """
+    refs, vendors = set(), set()
+    for chunk in _chunks(set(po_ids)):
+        for ref_key, vendor_key in db.query(POData.ref_key, POData.vendor_key).filter(POData.id.in_(chunk)):
+            if ref_key:
+                refs.add(ref_key)
+            if vendor_key:
+                vendors.add(vendor_key)
+    affected = set()
+    for chunk in _chunks(refs):
+        affected.update(row.id for row in db.query(InvoiceData.id).filter(InvoiceData.ref_key.in_(chunk)))
+    has_reference_match = exists().where(POData.ref_key == InvoiceData.ref_key)
+    for chunk in _chunks(vendors):
+        affected.update(
+            row.id for row in
+            db.query(InvoiceData.id).filter(InvoiceData.vendor_key.in_(chunk), ~has_reference_match)
+        )
+    return affected
+
+
+def reconcile_documents(db, invoice_ids=(), po_ids=()) -> dict:
+    """Incremental entry point after an upload: new invoices plus the invoices new POs affect."""
+    return reconcile_invoices(db, set(invoice_ids) | affected_invoice_ids(db, po_ids))
+
+
+def reconcile_batch(db, include_matched: bool = False) -> dict:
+    """
+    Reconcile every invoice that has no pair status yet (or every invoice,
+    with include_matched). Pairs whose documents are unchanged since they were
+    last compared are reported from the status table without recomputation.
+    """
+    query = db.query(InvoiceData.id)
+    if not include_matched:
+        evaluated = db.query(ReconciliationStatus.invoice_id)
+        query = query.filter(InvoiceData.id.notin_(evaluated))
+    return reconcile_invoices(db, [row.id for row in query])
+
+
+def evaluate_pair(db, invoice, po):
+    """
+    Status row for one explicit invoice/PO pair (e.g. the latest upload of
+    each), recomparing only if either document changed since the last time.
+    Returns (status, changed). Pairs that are not reference/vendor candidates
+    are kept as "manual" so incremental runs leave them alone.
+    """
+    vendors.refresh()
+    status = (
+        db.query(ReconciliationStatus)
+        .filter(ReconciliationStatus.invoice_id == invoice.id, ReconciliationStatus.po_id == po.id)
+        .first()
+    )
+    if status is not None and (status.invoice_version, status.po_version) == (invoice.content_version,
+                                                                            po.content_version):
+        return status, False
+    invoice_parsed, po_parsed = _load(invoice.parsed_data), _load(po.parsed_data)
+    discrepancies = detect_discrepancies(invoice_parsed, po_parsed) or {}
+    if status is None:
+        status = ReconciliationStatus(invoice_id=invoice.id, po_id=po.id)
+        db.add(status)
+        matched = invoice.ref_key and invoice.ref_key == po.ref_key
+        matched_on = "reference" if matched else (
+            "vendor" if invoice.vendor_key and invoice.vendor_key == po.vendor_key else "manual"
+        )
+    else:
+        matched_on = status.matched_on
+    _apply(status, invoice, po, matched_on, discrepancies)
+    return status, True
+
+
+def auto_reconcile(session_factory, invoice_ids=(), po_ids=()) -> None:
+    """
+    Run reconcile_documents in its own session after an insert. Two uploads
+    touching the same pair can race on the unique constraint; the loser
+    retries once against the winner's rows. Failures only log.
+    """
+    if not AUTO_RECONCILE or not (invoice_ids or po_ids):
+        return
+    db = session_factory()
+    try:
+        for attempt in range(2):
+            try:
+                reconcile_documents(db, invoice_ids, po_ids)
+                return
+            except IntegrityError:
+                db.rollback()
+                if attempt:
+                    raise
+    except Exception as e:
+        db.rollback()
+        print(f"[RECONCILE] Incremental reconciliation failed: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,110 @@
+# sql_guard.py  – sandboxed execution of LLM-generated SQL
+#
+# Generated queries run on the read-only engine with three extra guardrails:
+# 1) SQLite's EXPLAIN QUERY PLAN is checked first, and plans that full-scan a
+#    table inside another loop (a cross join or a join on an unindexed
+#    column) are rejected before they run.
+# 2) A progress handler interrupts the query once it exceeds its time budget
+#    (statement_timeout on PostgreSQL).
+# 3) Rows are fetched incrementally and stop at a row cap, so a huge result
+#    is never materialized.
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, DBAPIError
+
+from db import IS_SQLITE, read_engine
+from metrics import SQL_GUARDRAIL_EVENTS
+
+SQL_TIMEOUT_MS = int(os.getenv("VERIFIN_SQL_TIMEOUT_MS", "2000"))
+SQL_MAX_ROWS = int(os.getenv("VERIFIN_SQL_MAX_ROWS", "1000"))
+# SQLite VM instructions between deadline checks
+PROGRESS_STEPS = 10000
+
+
+class QueryRejected(Exception):
+    """A generated query was refused or stopped by a guardrail; the message is safe to show."""
+
+
+def _execute(conn, sql: str, params: Optional[dict]):
+    if params:
+        return conn.execute(text(sql), params)
+    return conn.exec_driver_sql(sql)
+
+
+def check_plan(plan_rows) -> Optional[str]:
+    """
+    Given EXPLAIN QUERY PLAN rows (id, parent, notused, detail), return why the
+    plan is unsafe, or None. Loops under the same parent are nested in order,
+    so any full SCAN after the first loop (or inside a correlated subquery)
+    runs once per outer row.
+    """
+    children = {}
+    for node_id, parent, _, detail in plan_rows:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    def _walk(parent: int, correlated: bool) -> Optional[str]:
+        loops = 0
+        for node_id, detail in children.get(parent, []):
+            if detail.startswith(("SCAN ", "SEARCH ")):
+                nested = loops > 0 or correlated
+                loops += 1
+                if nested and detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW":
+                    table = detail.split()[1]
+                    return (f"Query plan rejected: {table} would be fully scanned for every row of another table "
+                            "(cross join or join on an unindexed column). Join on an indexed column such as "
+                            "purchase_order_reference/purchase_order_id, vendor or a date.")
+            reason = _walk(node_id, correlated or detail.startswith("CORRELATED "))
+            if reason:
+                return reason
+        return None
+
+    return _walk(0, False)
+
+
+def run_guarded(sql: str, params: Optional[dict] = None, timeout_ms: Optional[int] = None,
+                max_rows: Optional[int] = None) -> dict:
+    """
+    Run one read-only query under the guardrails. Returns {"columns", "rows",
+    "truncated"}; raises QueryRejected for unsafe plans or exceeded budgets
+    and lets ordinary SQL errors propagate.
+    """
+    timeout_ms = SQL_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    max_rows = SQL_MAX_ROWS if max_rows is None else max_rows
+
+    with read_engine.connect() as conn:
+        raw = None
+        if IS_SQLITE:
+            reason = check_plan(list(_execute(conn, "EXPLAIN QUERY PLAN " + sql, params)))
+            if reason:
+                SQL_GUARDRAIL_EVENTS.inc(reason="plan")
+                raise QueryRejected(reason)
+            raw = conn.connection.dbapi_connection
+            deadline = time.monotonic() + timeout_ms / 1000
+            raw.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_STEPS)
+        else:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+        try:
+            result = _execute(conn, sql, params)
+            columns = list(result.keys())
+            # SQLite steps lazily, so the budget also covers fetching
+            rows = [tuple(row) for row in result.fetchmany(max_rows + 1)]
+            result.close()
+        except (OperationalError, DBAPIError) as e:
+            message = str(e.orig if getattr(e, "orig", None) is not None else e).lower()
+            if "interrupted" in message or "statement timeout" in message:
+                SQL_GUARDRAIL_EVENTS.inc(reason="timeout")
+                raise QueryRejected(f"Query stopped after exceeding its {timeout_ms} ms time budget.")
+            raise
+        finally:
+            if raw is not None:
+                # Pooled connection: don't leave the deadline behind for the next user
+                raw.set_progress_handler(None, 0)
+
+    truncated = len(rows) > max_rows
+    if truncated:
+        SQL_GUARDRAIL_EVENTS.inc(reason="row_cap")
+    return {"columns": columns, "rows": rows[:max_rows], "truncated": truncated}
@@ -2,6 +2,15 @@ const form = document.getElementById('uploadForm');
 const resultText = document.getElementById('resultText');
 const loading = document.getElementById('loading');
 
+async function waitForJob(jobId) {
+  for (;;) {
+    const res = await fetch(`/jobs/${jobId}`);
+    const job = await res.json();
+    if (job.status === 'done' || job.status === 'failed') return job;
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+  }
+}
+
 form.addEventListener('submit', async (e) => {
   e.preventDefault();
   loading.style.display = 'block';
@@ -19,12 +28,17 @@ form.addEventListener('submit', async (e) => {
     // Upload invoice
     const invoiceForm = new FormData();
     invoiceForm.append('file', invoiceFile);
-    await fetch('/upload-invoice', { method: 'POST', body: invoiceForm });
+    const invoiceRes = await fetch('/upload-invoice', { method: 'POST', body: invoiceForm });
+    const invoiceJob = await invoiceRes.json();
 
     // Upload PO
     const poForm = new FormData();
     poForm.append('file', poFile);
-    await fetch('/upload-po', { method: 'POST', body: poForm });
+    const poRes = await fetch('/upload-po', { method: 'POST', body: poForm });
+    const poJob = await poRes.json();
+
+    // Wait for both background parse jobs to finish
+    await Promise.all([waitForJob(invoiceJob.job_id), waitForJob(poJob.job_id)]);
 
     // Run discrepancy detection
     const res = await fetch('/detect-discrepancy?request=Find mismatched totals and suppliers');
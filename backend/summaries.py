@@ -0,0 +1,160 @@
+# summaries.py  – discrepancy summaries: templated now, LLM-polished later
+#
+# render_summary() turns a detect_discrepancies() result into prose locally, so
+# /detect-discrepancy never waits on the LLM. A polished version is requested
+# in the background and stored in summary_cache under a hash of the
+# discrepancy content (not the filenames), so every pair with the same
+# mismatch pattern reuses one LLM call.
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update
+
+from db import SessionLocal
+from models import SummaryCache
+from metrics import SUMMARY_LOOKUPS
+import llm_gateway
+
+# Set to 0 to serve templated summaries only.
+LLM_SUMMARIES = os.getenv("VERIFIN_LLM_SUMMARIES", "1") != "0"
+SUMMARY_WORKERS = int(os.getenv("VERIFIN_SUMMARY_WORKERS", "2"))
+
+SUMMARY_SYSTEM_PROMPT = "You are a helpful finance assistant."
+SUMMARY_PROMPT_HEADER = (
+    "You are a finance assistant. Summarize these discrepancies between an invoice "
+    "and a purchase order in clear, natural English. Mention which fields differ and their values. "
+    "Keep it concise and professional.\n\n"
+    "Discrepancies:\n"
+)
+
+MATCH_TEXT = "Invoice and Purchase Order match perfectly. No discrepancies found."
+
+_FIELD_LABELS = {
+    "reference_number": "PO reference",
+    "vendor": "vendor",
+    "total_amount": "total amount",
+    "date": "date",
+}
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="verifin-summary")
+_in_flight = set()
+_lock = threading.Lock()
+
+
+# ---------- Templated summary ----------
+def _value(value) -> str:
+    if value in (None, "", "missing"):
+        return "missing"
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def render_summary(discrepancies: dict) -> str:
+    """Deterministic plain-English summary of a detect_discrepancies() result."""
+    fields = {f: v for f, v in (discrepancies or {}).items() if f != "status" and isinstance(v, dict)}
+    if not fields:
+        return MATCH_TEXT
+    lines = []
+    for field, values in fields.items():
+        label = _FIELD_LABELS.get(field, field.replace("_", " "))
+        invoice, po = _value(values.get("invoice")), _value(values.get("po"))
+        if field == "total_amount" and invoice != "missing" and po != "missing":
+            delta = float(values["invoice"]) - float(values["po"])
+            lines.append(f"- The {label} differs: invoice {invoice}, PO {po} ({delta:+,.2f}).")
+        else:
+            lines.append(f"- The {label} differs: invoice {invoice}, PO {po}.")
+    noun = "field does" if len(lines) == 1 else "fields do"
+    return f"Invoice and PO do not match; {len(lines)} {noun} not agree:\n" + "\n".join(lines)
+
+
+# ---------- Polished summary cache ----------
+def summary_key(discrepancies: dict) -> str:
+    """Same mismatch content + same prompt and model -> same key."""
+    model = os.getenv("SHIVAAY_MODEL", "shivaay")
+    canonical = json.dumps(discrepancies, sort_keys=True, default=str)
+    return hashlib.sha256(
+        f"{model}\n{SUMMARY_SYSTEM_PROMPT}\n{SUMMARY_PROMPT_HEADER}\n{canonical}".encode("utf-8")
+    ).hexdigest()
+
+
+def get_polished(key: str) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        entry = db.query(SummaryCache.id, SummaryCache.summary_text).filter(SummaryCache.summary_key == key).first()
+        if entry is None:
+            return None
+        db.execute(
+            update(SummaryCache)
+            .where(SummaryCache.id == entry.id)
+            .values(hits=SummaryCache.hits + 1, last_used_at=datetime.utcnow())
+        )
+        db.commit()
+        return entry.summary_text
+    finally:
+        db.close()
+
+
+def _polish(key: str, discrepancies: dict) -> None:
+    """Runs on the summary pool: one LLM call, stored for every pair with this pattern."""
+    try:
+        text = llm_gateway.chat(
+            [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": SUMMARY_PROMPT_HEADER + json.dumps(discrepancies, indent=2, default=str)},
+            ],
+            temperature=0.3,
+            max_tokens=300
+        )
+        if not text or not text.strip():
+            return
+        db = SessionLocal()
+        try:
+            if not db.query(SummaryCache.id).filter(SummaryCache.summary_key == key).first():
+                db.add(SummaryCache(summary_key=key, summary_text=text.strip(), hits=0))
+                db.commit()
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"[SUMMARY] Could not polish summary: {e}")
+    finally:
+        with _lock:
+            _in_flight.discard(key)
+
+
+def request_polish(key: str, discrepancies: dict) -> bool:
+    """Queue an LLM summary for this pattern unless one is already queued. Returns True if queued."""
+    if not LLM_SUMMARIES:
+        return False
+    with _lock:
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+    _executor.submit(_polish, key, discrepancies)
+    return True
+
+
+def summarize(discrepancies: dict) -> tuple:
+    """
+    Returns (text, source) immediately: the cached LLM summary for this
+    mismatch pattern ("llm"), or the templated one ("template") while a
+    polished version is generated in the background. Exact matches are
+    always templated.
+    """
+    fields = [f for f in (discrepancies or {}) if f != "status"]
+    if not fields:
+        SUMMARY_LOOKUPS.inc(source="template")
+        return MATCH_TEXT, "template"
+    key = summary_key(discrepancies)
+    polished = get_polished(key) if LLM_SUMMARIES else None
+    if polished is not None:
+        SUMMARY_LOOKUPS.inc(source="llm")
+        return polished, "llm"
+    request_polish(key, discrepancies)
+    SUMMARY_LOOKUPS.inc(source="template")
+    return render_summary(discrepancies), "template"
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Flat backend modules, and a throwaway database configured before db is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "VERIFIN_DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='verifin-test-'), 'test.db')}"
+)
+os.environ.setdefault("VERIFIN_PREWARM", "")
+os.environ.setdefault("SHIVAAY_API_KEY", "test")
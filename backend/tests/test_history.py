@@ -0,0 +1,69 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import models  # noqa: F401  (registers the tables)
+import history
+from db import engine, init_db
+
+
+@pytest.fixture(autouse=True)
+def discrepancies():
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM discrepancies"))
+        # As written by server_default=func.now(): text, whole seconds, all in one second
+        for n in range(1, 6):
+            conn.execute(
+                text("INSERT INTO discrepancies (id, description, timestamp) VALUES (:id, :d, :ts)"),
+                {"id": n, "d": f"row {n}", "ts": "2026-03-01 10:00:00"},
+            )
+        conn.execute(
+            text("INSERT INTO discrepancies (id, description, timestamp) VALUES (6, 'row 6', '2026-03-02 09:00:00')")
+        )
+
+
+def test_pages_through_rows_sharing_one_timestamp():
+    ids, cursor = [], None
+    for _ in range(10):
+        result = history.page(cursor=cursor, limit=2)
+        ids.extend(item["id"] for item in result["items"])
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == [6, 5, 4, 3, 2, 1]
+
+
+def test_date_range_includes_whole_days():
+    result = history.page(date_from=date(2026, 3, 1), date_to=date(2026, 3, 1), limit=10)
+    assert [item["id"] for item in result["items"]] == [5, 4, 3, 2, 1]
+    result = history.page(date_from=date(2026, 3, 2), limit=10)
+    assert [item["id"] for item in result["items"]] == [6]
+
+
+def test_export_streams_every_row_once():
+    lines = "".join(history.export("ndjson")).splitlines()
+    assert len(lines) == 6
+
+
+def test_rejects_malformed_cursor():
+    with pytest.raises(ValueError):
+        history.page(cursor="not-a-cursor")
+
+
+def test_vendor_filter_sees_aliases_confirmed_elsewhere():
+    from discrepancy_engine import VENDOR_ALIASES
+    import vendors
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM invoice_data"))
+        conn.execute(text("INSERT INTO invoice_data (id, vendor, vendor_key) VALUES (1, 'Acme Corp', 'acme')"))
+        conn.execute(text("UPDATE discrepancies SET invoice_id = 1 WHERE id = 6"))
+    vendors.register(["Acme Corp", "Acme Holdings Group"])
+    vendors.add_alias("Acme Holdings Group", "Acme Corp")
+    # Another worker that loaded the alias map before the alias was added
+    VENDOR_ALIASES.clear()
+    vendors._alias_version = None
+
+    assert [item["id"] for item in history.page(vendor="Acme Holdings Group")["items"]] == [6]
@@ -0,0 +1,257 @@
+# vendors.py  – vendor canonicalization: persistent alias table + trigram index
+#
+# Every vendor name seen in invoice_data / po_data is reduced to its canonical
+# form (discrepancy_engine.canonical_vendor), and every new canonical form
+# becomes a row in vendors. A new form similar enough to an existing vendor is
+# only recorded in vendor_aliases as a "suggested" alias: a wrong fuzzy match
+# must not merge two vendors for good, so spellings resolve to another vendor
+# only through "manual" aliases a person confirmed (POST /vendors/aliases).
+# Both tables are mirrored in memory: an inverted trigram index answers
+# candidate lookups without scanning every vendor, and the confirmed alias map
+# is shared with discrepancy_engine so vendor_key/same_vendor see it. Alias
+# changes bump a version in app_state so every process reloads the map.
+import threading
+from collections import Counter
+from typing import Iterable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+import discrepancy_engine
+from discrepancy_engine import VENDOR_ALIASES, canonical_vendor, vendor_similarity, vendor_trigrams
+from db import SessionLocal
+from models import AppState, InvoiceData, POData, Vendor, VendorAlias
+
+ALIAS_VERSION_KEY = "vendor_aliases_version"
+
+
+class TrigramIndex:
+    """Inverted index trigram -> vendor keys, candidates scored with vendor_similarity()."""
+
+    def __init__(self):
+        self._postings = {}
+
+    def add(self, key: str) -> None:
+        for gram in vendor_trigrams(key):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def search(self, key: str, threshold: float, limit: int = 5) -> List[tuple]:
+        """[(vendor key, similarity)] at or above threshold, best first."""
+        grams = vendor_trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        scored = []
+        for candidate, count in shared.items():
+            # Jaccard can't reach the threshold with this few shared trigrams
+            if count < threshold * len(grams):
+                continue
+            score = vendor_similarity(key, candidate)
+            if score >= threshold:
+                scored.append((candidate, score))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+
+_index = TrigramIndex()
+_vendor_ids = {}   # vendor name_key -> id
+_vendor_keys = {}  # id -> name_key
+_loaded = False
+_alias_version = None
+_lock = threading.Lock()
+
+
+def _version(db) -> int:
+    state = db.get(AppState, ALIAS_VERSION_KEY)
+    return state.value if state else 0
+
+
+def _bump_version(db) -> None:
+    updated = db.execute(
+        update(AppState).where(AppState.key == ALIAS_VERSION_KEY).values(value=AppState.value + 1)
+    ).rowcount
+    if not updated:
+        db.add(AppState(key=ALIAS_VERSION_KEY, value=1))
+
+
+def load(force: bool = False) -> None:
+    """Read vendors and confirmed aliases into memory (once per process unless forced)."""
+    global _index, _loaded, _alias_version
+    with _lock:
+        if _loaded and not force:
+            return
+        db = SessionLocal()
+        try:
+            version = _version(db)
+            index, ids = TrigramIndex(), {}
+            for vendor_id, name_key in db.query(Vendor.id, Vendor.name_key):
+                ids[name_key] = vendor_id
+                index.add(name_key)
+            keys = {vendor_id: name_key for name_key, vendor_id in ids.items()}
+            aliases = {
+                alias_key: keys[vendor_id]
+                for alias_key, vendor_id in db.query(VendorAlias.alias_key, VendorAlias.vendor_id)
+                .filter(VendorAlias.source == "manual")
+                if vendor_id in keys
+            }
+        finally:
+            db.close()
+        _index = index
+        _vendor_ids.clear()
+        _vendor_ids.update(ids)
+        _vendor_keys.clear()
+        _vendor_keys.update(keys)
+        VENDOR_ALIASES.clear()
+        VENDOR_ALIASES.update(aliases)
+        _alias_version = version
+        _loaded = True
+
+
+def refresh() -> None:
+    """Reload if another process changed the confirmed aliases since this one loaded them."""
+    if not _loaded:
+        load()
+        return
+    db = SessionLocal()
+    try:
+        version = _version(db)
+    finally:
+        db.close()
+    if version != _alias_version:
+        load(force=True)
+
+
+def _add_vendor(db, key: str, display_name: str) -> None:
+    vendor = Vendor(name_key=key, display_name=display_name[:255])
+    db.add(vendor)
+    db.flush()
+    _vendor_ids[key] = vendor.id
+    _vendor_keys[vendor.id] = key
+    _index.add(key)
+
+
+def _add_alias(db, alias_key: str, vendor_key: str, similarity: Optional[float], source: str) -> None:
+    """Store a "manual" alias (resolves from now on) or a "suggested" one (awaits confirmation)."""
+    existing = db.query(VendorAlias).filter(VendorAlias.alias_key == alias_key).first()
+    if existing is None:
+        db.add(VendorAlias(alias_key=alias_key, vendor_id=_vendor_ids[vendor_key],
+                           similarity=similarity, source=source))
+    elif existing.source != "manual" or source == "manual":
+        existing.vendor_id, existing.similarity, existing.source = _vendor_ids[vendor_key], similarity, source
+    if source == "manual":
+        VENDOR_ALIASES[alias_key] = vendor_key
+
+
+def _register_once(names) -> Optional[int]:
+    with _lock:
+        pending = {}
+        for name in names:
+            key = canonical_vendor(name)[:255]
+            if key and key not in _vendor_ids and key not in VENDOR_ALIASES and key not in pending:
+                pending[key] = str(name)
+        if not pending:
+            return 0
+        db = SessionLocal()
+        try:
+            for key, display_name in pending.items():
+                match = _index.search(key, discrepancy_engine.VENDOR_SIMILARITY, limit=1)
+                _add_vendor(db, key, display_name)
+                if match:
+                    # A vendor merged into another by a manual alias resolves to the target
+                    target = VENDOR_ALIASES.get(match[0][0], match[0][0])
+                    _add_alias(db, key, target, round(match[0][1], 3), "suggested")
+            db.commit()
+            return len(pending)
+        except IntegrityError:
+            # Another process registered some of these first
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+
+def register(names: Iterable) -> int:
+    """
+    Make sure every vendor name resolves to a vendor: unknown canonical forms
+    become new vendors, with the most similar existing vendor recorded as a
+    suggested alias. Call before computing vendor_key for new rows. Returns
+    how many were new.
+    """
+    refresh()
+    names = [name for name in names if name]
+    added = _register_once(names)
+    if added is None:
+        # Pick up the other writer's rows, then add whatever is still missing
+        load(force=True)
+        added = _register_once(names) or 0
+    return added
+
+
+def add_alias(alias: str, vendor: str) -> dict:
+    """
+    Manually map one vendor spelling onto another (the target is created if
+    unknown), e.g. to confirm a suggestion, and re-key stored invoices/POs
+    that resolved to the alias. Returns the mapping and the ids of the
+    invoices whose vendor_key changed.
+    """
+    register([vendor])
+    alias_key, target = canonical_vendor(alias)[:255], discrepancy_engine.vendor_key(vendor)
+    if not alias_key or not target:
+        raise ValueError("Both alias and vendor must contain letters or digits")
+    if alias_key == target:
+        raise ValueError("Alias and vendor are already the same vendor")
+    with _lock:
+        db = SessionLocal()
+        try:
+            _add_alias(db, alias_key, target, None, "manual")
+            # Spellings that pointed at the alias now point at the target too
+            merged = [key for key, value in VENDOR_ALIASES.items() if value == alias_key]
+            for key in merged:
+                _add_alias(db, key, target, None, "manual")
+            old_keys = [alias_key, *merged]
+            invoice_ids = [row.id for row in db.query(InvoiceData.id).filter(InvoiceData.vendor_key.in_(old_keys))]
+            for model in (InvoiceData, POData):
+                db.query(model).filter(model.vendor_key.in_(old_keys)).update(
+                    {model.vendor_key: target}, synchronize_session=False
+                )
+            _bump_version(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return {"alias": alias_key, "vendor": target, "vendor_id": _vendor_ids[target], "invoice_ids": invoice_ids}
+
+
+def suggestions(limit: int = 100) -> list:
+    """Fuzzy alias matches awaiting confirmation, most similar first."""
+    refresh()
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(VendorAlias.alias_key, VendorAlias.vendor_id, VendorAlias.similarity)
+            .filter(VendorAlias.source != "manual")
+            .order_by(VendorAlias.similarity.desc(), VendorAlias.id)
+            .limit(limit)
+            .all()
+        )
+    finally:
+        db.close()
+    return [
+        {"alias": alias_key, "vendor": _vendor_keys.get(vendor_id), "vendor_id": vendor_id, "similarity": similarity}
+        for alias_key, vendor_id, similarity in rows
+    ]
+
+
+def match(name: str, limit: int = 5) -> dict:
+    """Candidate vendors for a name: its resolved key plus trigram neighbours above the threshold."""
+    refresh()
+    key = canonical_vendor(name)
+    resolved = discrepancy_engine.vendor_key(name)
+    candidates = [
+        {"vendor_key": candidate, "vendor_id": _vendor_ids.get(candidate), "similarity": round(score, 3)}
+        for candidate, score in _index.search(resolved or key, discrepancy_engine.VENDOR_SIMILARITY, limit)
+    ]
+    return {"name": name, "canonical": key, "vendor_key": resolved if resolved in _vendor_ids else None,
+            "candidates": candidates}
@@ -1,3 +1,14 @@
+async function waitForJob(jobId: string, intervalMs = 1000) {
+  for (;;) {
+    const res = await fetch(`/api/jobs/${jobId}`)
+    if (!res.ok) throw new Error(`Job ${jobId} lookup failed: ${res.status}`)
+    const job = await res.json()
+    if (job.status === "done") return job
+    if (job.status === "failed") throw new Error(`Job ${jobId} failed: ${job.error}`)
+    await new Promise((resolve) => setTimeout(resolve, intervalMs))
+  }
+}
+
 export async function uploadInvoice(file: File) {
   const formData = new FormData()
   formData.append("file", file)
@@ -6,7 +17,8 @@ export async function uploadInvoice(file: File) {
     body: formData,
   })
   if (!res.ok) throw new Error(`Upload invoice failed: ${res.status}`)
-  return res.json()
+  const { job_id } = await res.json()
+  return waitForJob(job_id)
 }
 
 export async function uploadPO(file: File) {
@@ -17,7 +29,8 @@ export async function uploadPO(file: File) {
     body: formData,
   })
   if (!res.ok) throw new Error(`Upload PO failed: ${res.status}`)
-  return res.json()
+  const { job_id } = await res.json()
+  return waitForJob(job_id)
 }
 
 export async function getDiscrepancySummary(): Promise<string> {